@@ -1,4 +1,8 @@
 
+import numpy as np
+import pandas as pd
+
+
 def levenshtein(s1, s2):
     """Calculate Levenshtein distance based on string1 and string2
 
@@ -31,11 +35,12 @@ def levenshtein(s1, s2):
     return previous_row[-1]
 
 
-def virtual_pe_density(df):
+def virtual_pe_density(df, pool=None):
     """Calculate post edit density for MT strings.
 
     Arguments:
         df -- 
+        pool -- Optional process pool for computing the Levenshtein distances in parallel
 
 
     Returns:
@@ -43,22 +48,36 @@ def virtual_pe_density(df):
                  updated cache with ped result
     """
     
+    # Compute distances only once per unique target-mt pair and map the results back to the rows.
+    codes, pairs = pd.MultiIndex.from_arrays([df.target, df.mt]).factorize()
+    max_char = np.array([max(len(target), len(mt)) for target, mt in pairs], dtype=np.int64)
+    if pool is None:
+        lev = np.array([levenshtein(target, mt) for target, mt in pairs], dtype=np.int64)
+    else:
+        lev = np.fromiter(pool.map(levenshtein, pairs.get_level_values(0), pairs.get_level_values(1),
+                                   chunksize=256), dtype=np.int64, count=len(pairs))
+
     # Write the maximum length for each target-mt pair to a new column. We need this value to avoid dividing by zero.
-    df["max_char"] = df.apply(lambda x: max(len(x.target), len(x.mt)), axis=1)
+    df["max_char"] = max_char[codes]
     # Calculate Levenshtein distance for each target-mt pair.
-    df["lev"] = df.apply(lambda x: levenshtein(x.target, x.mt), axis=1)
+    df["lev"] = lev[codes]
     # Normalize Levenshtein distance by maximum segment length.
     df['virtual'] = df['lev'].copy().div(df['max_char'])
 
     return df
 
 
-def pe_density(df):
-    """Calculate the aggregated Post-Edit Distance score for all rows in a DataFrame."""
+def pe_density(df, pool=None):
+    """Calculate the aggregated Post-Edit Distance score for all rows in a DataFrame.
+
+    Arguments:
+        df -- DataFrame object with "target" and "mt" columns
+        pool -- Optional process pool for computing the Levenshtein distances in parallel
+    """
 
     # If PED has not been computed yet, insert the scores in the virtual column.
     col_names = {"virtual": df.score,
-                 "max_char": df.apply(lambda x: max(len(x.target), len(x.mt)), axis=1),
+                 "max_char": np.maximum(df.target.str.len(), df.mt.str.len()).astype("int64"),
                  "lev": None
                  }
 
@@ -73,11 +92,14 @@ def pe_density(df):
 
     # Only strings that have been altered need to be recomputed,
     # When replacing a string in the MT column, we reset the virtual value to NaN.
-    if df['virtual'].isna().any():
+    reset = df['virtual'].isna()
+    if reset.any():
         # Slice the table and recompute the virtual score.
-        df_update = virtual_pe_density(df[df['virtual'].isna()].copy())
-        # Update the table with the table slice.
-        df.update(df_update)
+        df_update = virtual_pe_density(df[reset].copy(), pool)
+        # Update the recomputed columns only and keep their dtypes, so that chunks of a table
+        # written one after another share one schema. Distances derived from scores are fractional.
+        for name, dtype in (("max_char", "int64"), ("lev", "float64"), ("virtual", "float64")):
+            df[name] = df[name].mask(reset, df_update[name]).astype(dtype)
 
     ped = df['lev'].sum() / df['max_char'].sum()
 
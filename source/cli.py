@@ -0,0 +1,161 @@
+"""Command line interface for running the Reader and Writer logic in batch jobs.
+
+Examples:
+    python -m source.cli ingest data reports.csv
+    python -m source.cli export reports.csv reports.xlsx --by Project
+    python -m source.cli summary reports.csv --by t_lid --ci 0.95
+    python -m source.cli apply out/wmt16_en-es.json data/sample.sdlxliff package.zip
+    python -m source.cli benchmark out/wmt16_en-es.json reports.csv --repeat 10
+
+Heavy libraries are imported inside the commands, so applying a rulebook to
+XLIFF files does not load pandas or any plotting library.
+"""
+import argparse
+import sys
+
+
+def ingest(args):
+    """Convert a directory of archived reports into a single CSV or Parquet table."""
+    from source.table import COLUMNS, read_chunks, save_chunks
+
+    chunks = (df.reindex(columns=COLUMNS) for df in read_chunks(args.directory, args.chunksize))
+    rows = save_chunks(chunks, args.out)
+    print("{} rows written to {}".format(rows, args.out))
+
+
+def export(args):
+    """Export a table to Excel, CSV or Parquet in chunks, with one Excel sheet per group."""
+    from source.table import export_report, read_chunks
+
+    rows = export_report(read_chunks(args.table, args.chunksize), args.out, split_by=args.by,
+                         max_rows=args.max_rows)
+    for name, count in rows.items():
+        print("{}\t{} rows".format(name, count))
+
+
+def summary(args):
+    """Print the aggregated PED per group, optionally with bootstrap confidence intervals."""
+    import pandas as pd
+
+    from source.calculation import pe_density
+    from source.table import read_chunks
+
+    # Keep only the columns needed for the summary so that memory is bounded by the number of segments.
+    parts = list()
+    for df in read_chunks(args.table, args.chunksize):
+        _, df = pe_density(df)
+        columns = ["lev", "max_char"] + ([args.by] if args.by else [])
+        parts.append(df[columns])
+    data = pd.concat(parts, ignore_index=True)
+
+    if args.ci:
+        from source.significance import bootstrap_ped
+
+        result = bootstrap_ped(data, args.by, n_resamples=args.resamples, ci=args.ci, seed=args.seed)
+    else:
+        groups = data.groupby(args.by) if args.by else data.groupby(lambda _: "All")
+        result = groups[["lev", "max_char"]].sum()
+        result["segments"] = groups.size()
+        result["ped"] = result["lev"] / result["max_char"]
+
+    print(result.to_string())
+
+
+def apply(args):
+    """Apply a JSON rulebook to SDLXLIFF files, directories or zip archives."""
+    from source.subs import PreprocSub
+
+    # A dry run does not write anything, including the compiled rulebook cache and the backup
+    subs = PreprocSub()
+    subs.load_from_json(args.rulebook, use_cache=not args.dry_run)
+    paths = args.paths[0] if len(args.paths) == 1 and not args.paths[0].endswith((".sdlxliff", ".zip")) \
+        else args.paths
+    cache = subs.apply_to_working_files(paths, write=not args.dry_run)
+
+    for fp, changed in cache.items():
+        print("{}\t{} trans-units changed".format(fp, len(changed)))
+        if args.verbose:
+            for tu_id, entries in changed.items():
+                print("\t{}\t{}".format(tu_id, "; ".join(str(entry.desc) for entry in entries)))
+
+
+def benchmark(args):
+    """Compare run time and memory of a rulebook on object and Arrow-backed string columns."""
+    import time
+
+    import pandas as pd
+
+    from source.subs import PreprocSub
+    from source.table import ARROW_STRING, STRING_COLUMNS, read_chunks, to_string_dtype
+
+    df = pd.concat(read_chunks(args.table, args.chunksize), ignore_index=True)
+    df = pd.concat([df] * args.repeat, ignore_index=True)
+    print("{} rows, {} unique MT strings".format(len(df), df.mt.nunique()))
+
+    for name, dtype in (("object", object), ("arrow", ARROW_STRING)):
+        data = to_string_dtype(df, dtype)
+        columns = [col for col in STRING_COLUMNS if col in data.columns]
+        memory = data[columns].memory_usage(index=False, deep=True).sum()
+        subs = PreprocSub(fp=args.rulebook)
+
+        start = time.perf_counter()
+        subs.apply_to_table(data, parallel=args.parallel)
+        elapsed = time.perf_counter() - start
+
+        print("{}\t{:.2f} s\t{:.1f} MB\tPED effect {:f}".format(name, elapsed, memory / 2 ** 20, subs.ped_effect))
+
+
+def build_parser():
+
+    parser = argparse.ArgumentParser(prog="python -m source.cli", description=__doc__.split("\n")[0])
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    p = commands.add_parser("ingest", help=ingest.__doc__)
+    p.add_argument("directory", help="Directory with archived JSON/CSV reports")
+    p.add_argument("out", help="Output file (.csv or .parquet)")
+    p.add_argument("--chunksize", type=int, default=100000)
+    p.set_defaults(func=ingest)
+
+    p = commands.add_parser("export", help=export.__doc__)
+    p.add_argument("table", help="CSV, JSON lines or Parquet file, or directory with reports")
+    p.add_argument("out", help="Output file (.xlsx, .csv or .parquet)")
+    p.add_argument("--by", help="Column for splitting Excel sheets, e.g. Project or Relation")
+    p.add_argument("--max-rows", type=int, default=1000000, help="Maximum number of rows per Excel sheet")
+    p.add_argument("--chunksize", type=int, default=100000)
+    p.set_defaults(func=export)
+
+    p = commands.add_parser("summary", help=summary.__doc__)
+    p.add_argument("table", help="CSV, JSON lines or Parquet file, or directory with reports")
+    p.add_argument("--by", help="Column to group by, e.g. t_lid, Relation or Project")
+    p.add_argument("--ci", type=float, help="Confidence level for bootstrap intervals, e.g. 0.95")
+    p.add_argument("--resamples", type=int, default=10000)
+    p.add_argument("--seed", type=int)
+    p.add_argument("--chunksize", type=int, default=100000)
+    p.set_defaults(func=summary)
+
+    p = commands.add_parser("apply", help=apply.__doc__)
+    p.add_argument("rulebook", help="JSON rulebook created with PreprocSub.convert_to_json")
+    p.add_argument("paths", nargs="+", help="SDLXLIFF files, zip archives or a single directory")
+    p.add_argument("--dry-run", action="store_true", help="Do not write any files")
+    p.add_argument("--verbose", action="store_true", help="List changed trans-units and entries")
+    p.set_defaults(func=apply)
+
+    p = commands.add_parser("benchmark", help=benchmark.__doc__)
+    p.add_argument("rulebook", help="JSON rulebook created with PreprocSub.convert_to_json")
+    p.add_argument("table", help="CSV, JSON lines or Parquet file, or directory with reports")
+    p.add_argument("--repeat", type=int, default=1, help="Number of copies of the table")
+    p.add_argument("--parallel", action="store_true", help="Apply entries in waves and compute distances in processes")
+    p.add_argument("--chunksize", type=int, default=100000)
+    p.set_defaults(func=benchmark)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,10 @@
 import ipywidgets as widgets
 from ipywidgets import Layout
 
+from source.calculation import pe_density
 from source.table import build_query
+from source.significance import bootstrap_ped
+from source.utils import plot
 
 
 class MyFilterWidget(widgets.Tab):
@@ -117,3 +120,36 @@ class MyFilterWidget(widgets.Tab):
         assert len(data) != 0, "Not enough data"
 
         return data
+
+    def ped_intervals(self, cat_column=None, n_resamples=10000, ci=0.95):
+        """Compute bootstrap confidence intervals for the aggregated PED of the current query.
+
+        Arguments:
+            cat_column -- String; categorical variable for computing one interval per group (e.g. "t_lid")
+            n_resamples -- Number of bootstrap resamples
+            ci -- Confidence level of the interval
+
+        Returns:
+            DataFrame with one row per group, see significance.bootstrap_ped
+        """
+        return bootstrap_ped(self.run_query(), cat_column, n_resamples=n_resamples, ci=ci)
+
+    def plot(self, data=None, ci=None, n_resamples=10000, **kwargs):
+        """Plot the PED score distribution of the current query, see utils.plot.
+
+        Arguments:
+            data -- Optional DataFrame object, e.g. from run_query(). Defaults to the current query.
+            ci -- Optional confidence level, e.g. 0.95. If set, the bootstrap interval of the
+                  aggregated PED is shown on the plot.
+            n_resamples -- Number of bootstrap resamples
+            kwargs -- Keyword arguments for utils.plot, e.g. cat_column, kde or save
+        """
+        data = self.run_query() if data is None else data
+        ped, data = pe_density(data)
+
+        ped_ci = None
+        if ci:
+            interval = bootstrap_ped(data, n_resamples=n_resamples, ci=ci).iloc[0]
+            ped_ci = (interval["lower"], interval["upper"])
+
+        plot(data, ped=ped, ped_ci=ped_ci, **kwargs)
@@ -1,4 +1,5 @@
 import re
+from bisect import bisect_right
 
 from lxml import etree as ET
 import os
@@ -6,6 +7,9 @@ import sys
 
 
 class BaseEntry(object):
+    # Entry attributes that hold regular expressions
+    PATTERNS = ("search", "source_filter")
+
     def __init__(self, search, replace, ID=None, created_by=None, ped_effect=None, desc=None,
                  s_lid=None, t_lid=None, source_filter=None):
 
@@ -22,26 +26,60 @@ class BaseEntry(object):
                            'sdl': 'http://sdl.com/FileTypes/SdlXliff/1.0'
                            }
 
-    def replace_target(self, element, replace=None):
+    def get_pattern(self, attr="search"):
+        """Return the compiled regex for an entry attribute.
 
-        replace = self.replace if replace is None else replace
+        Patterns are compiled once and cached on the entry. The cache is keyed by
+        the pattern string so that editing an attribute invalidates the old pattern.
+        """
+        string = r'{}'.format(getattr(self, attr))
+        patterns = self.__dict__.setdefault("_patterns", dict())
+        if string not in patterns:
+            patterns[string] = re.compile(string)
+
+        return patterns[string]
+
+    def __getstate__(self):
+        # Compiled patterns are not pickled. Unpickling would compile them again for every entry.
+        state = self.__dict__.copy()
+        state.pop("_patterns", None)
+        return state
+
+    def compile(self):
+        """Validate and precompile all regular expressions of the entry."""
+
+        for attr in self.PATTERNS:
+            if getattr(self, attr) is None:
+                continue
+            try:
+                self.get_pattern(attr)
+            except re.error as e:
+                raise ValueError("Invalid {} pattern in entry {!r}: {}".format(attr, self.desc, e))
+
+        return self
 
-        target = element.find("xliff:target", self.NAMESPACES).iter()
+    def replace_target(self, element, replace=None):
+        """Run search and replace on the target segment of a trans-unit.
 
-        # If the segment contains inline tags, run search and replace on each each substring
-        for substring in target:
-            if substring.text:
-                substring.text = re.sub(self.search, replace, substring.text)
+        Returns:
+            True if any string in the target segment was changed, else False
+        """
+
+        replace = self.replace if replace is None else replace
+        segments = target_segments(element.find("xliff:target", self.NAMESPACES))
 
-            elif substring.tail:
-                substring.tail = re.sub(self.search, replace, substring.tail)
+        # Run on every segment, so no short-circuit evaluation
+        return any([segment.sub(self.get_pattern(), replace) for segment in segments])
 
     def mask_match(self, df):
         """Reset virtual score if MT string matches search expression."""
 
-        p = re.compile(r'{}'.format(self.search))
+        # Deferred import since pandas is only needed for DataFrame objects
+        from source.table import map_unique, str_contains
 
-        return df["virtual"].mask(df.mt.str.contains(p) == True)
+        p = self.get_pattern()
+
+        return df["virtual"].mask(map_unique(df.mt, lambda mt: str_contains(mt, p)) == True)
 
 
 class SearchMTEntry(BaseEntry):
@@ -51,13 +89,16 @@ class SearchMTEntry(BaseEntry):
     def search_and_replace(self, obj):
 
         if obj.__class__.__name__ == "DataFrame":
+            from source.table import map_unique, str_replace
 
-            obj['virtual'] = self.mask_match(obj.copy())
+            obj['virtual'] = self.mask_match(obj)
 
-            obj.mt = obj.mt.str.replace(self.search, self.replace)
+            p = self.get_pattern()
+            obj.mt = map_unique(obj.mt, lambda mt: str_replace(mt, p, self.replace))
 
         elif obj.__class__.__name__ == "list":
-            obj = [self.replace_target(element) for element in obj]
+            # Return only the trans-units that have been changed
+            obj = [element for element in obj if self.replace_target(element)]
 
         return obj
 
@@ -70,32 +111,41 @@ class SearchSourceEntry(BaseEntry):
 
     def search_and_replace(self, obj):
 
-        p = re.compile(r'{}'.format(self.source_filter))
+        p = self.get_pattern("source_filter")
 
         if obj.__class__.__name__ == "DataFrame":
+            from source.table import map_unique, str_contains, str_replace
+
             # Create filter based on source expression
-            source_filter = obj.source.str.contains(p)
+            source_filter = map_unique(obj.source, lambda source: str_contains(source, p))
             # Copy filtered values to update table
             update = obj[source_filter].copy()
             # Reset virtual scores if row matches source filter and search expression matches MT string
-            obj['virtual'] = obj['virtual'].mask(source_filter, self.mask_match(obj.copy()))
+            obj['virtual'] = obj['virtual'].mask(source_filter, self.mask_match(obj))
             # Apply search and replace to update table
-            update = update.mt.str.replace(self.search, self.replace)
+            search = self.get_pattern()
+            update = map_unique(update.mt, lambda mt: str_replace(mt, search, self.replace))
             # Overwrite values in original table with update values
             obj.mt.update(update)
 
         elif obj.__class__.__name__ == "list":
+            changed = list()
             for element in obj:
                 # Parse string data in source segment
                 seg_source = ''.join(element.find("xliff:seg-source", self.NAMESPACES).itertext())
                 # Parse target segment if expression is in source
-                if re.search(p, seg_source):
-                    self.replace_target(element)
+                if re.search(p, seg_source) and self.replace_target(element):
+                    changed.append(element)
+            # Return only the trans-units that have been changed
+            obj = changed
 
         return obj
 
 
 class ToggleCaseEntry(BaseEntry):
+    # The search attribute holds the number of characters to change
+    PATTERNS = ("source_filter",)
+
     def __init__(self, kwargs):
         # Entry validation
         kwargs['search'] = int(kwargs['search'])
@@ -113,7 +163,7 @@ class ToggleCaseEntry(BaseEntry):
             the first n character of the target string.
 
         Returns
-            Updated object with the case changed
+            Updated DataFrame with the case changed or list of changed trans-units
         """
 
         search_length = self.search
@@ -124,25 +174,23 @@ class ToggleCaseEntry(BaseEntry):
                          }
 
         if obj.__class__.__name__ == "DataFrame":
+            from source.table import map_unique
+
             # Get source check variable from function dictionary using the replace attribute as key.
             source_check = function_dict.get(self.replace)[2]
             # Transform the string source variable to a Series string method by passing it to getattr.
             # We use the method to filter for rows in which the first n source characters match the required case.
-            source_filter = getattr(obj.source.str[0:search_length].str, source_check)()
-            update = obj[source_filter].copy()
-            # Reset virtual scores if row matches source filter and search expression matches MT string
-            obj['virtual'] = obj['virtual'].mask(source_filter, self.mask_match(obj.copy()))
-            # Convert the first n MT characters to the required case and create Series
-            update = getattr(update.mt.str[0:search_length].str, self.replace)()
-
-            # Extract MT strings that have not been changed and create Pandas Series
-            if search_length is not None:
-                rest = obj[source_filter].mt.str[search_length:]
-                # Concatenate strings and update MT column
-                obj.mt.update(update + rest)
-
-            else:
-                obj.mt.update(update)
+            source_filter = map_unique(obj.source,
+                                       lambda source: getattr(source.str[0:search_length].str, source_check)())
+            mt = obj.mt[source_filter.fillna(False).astype(bool)]
+            # Convert the first n MT characters to the required case and keep the rest of the string
+            update = map_unique(mt, lambda mt: getattr(mt.str[0:search_length].str, self.replace)()
+                                .str.cat(mt.str[search_length:]))
+            update = update[((update != mt) & update.notna()).fillna(False).astype(bool)]
+
+            # Reset virtual scores of the changed rows and update the MT column in place
+            obj.loc[update.index, 'virtual'] = float("nan")
+            obj.mt.update(update)
 
         elif obj.__class__.__name__ == "list":
 
@@ -150,14 +198,7 @@ class ToggleCaseEntry(BaseEntry):
             source_check = function_dict.get(self.replace)[0]
             action = function_dict.get(self.replace)[1]
 
-            def update_substring(string, search_len, act):
-
-                end = min(len(string), search_len)
-                upd = act(string[:end])
-                string = upd + string[end:]
-                search_len -= end
-                return string, search_len
-
+            changed = list()
             # Iterate over trans-units to parse source and target segments
             for element in obj:
 
@@ -165,21 +206,13 @@ class ToggleCaseEntry(BaseEntry):
                 # Call the check method from the function dict
                 if source_check(seg_source[0:min(len(seg_source), self.search)]):
 
-                    target = element.find("xliff:target", self.NAMESPACES).iter()
-                    # Set length of replacement string for each target segment
-                    search_length = self.search
-                    running = True
-                    while running:
-                        # If the segment contains inline tags, run search and replace on each each substring
-                        for substring in target:
-                            if search_length <= 0:
-                                running = False
-                            elif substring.text is not None:
-                                substring.text, search_length = update_substring(substring.text, search_length, action)
-                            elif substring.tail is not None:
-                                substring.tail, search_length = update_substring(substring.tail, search_length, action)
-                            else:
-                                running = False
+                    # The prefix belongs to the first segment with text
+                    segments = target_segments(element.find("xliff:target", self.NAMESPACES))
+                    target = next((segment for segment in segments if segment.string), None)
+                    if target is not None and target.transform_prefix(self.search, action):
+                        changed.append(element)
+            # Return only the trans-units that have been changed
+            obj = changed
 
         return obj
 
@@ -193,41 +226,50 @@ class ApplyTagEntry(BaseEntry):
         if obj.__class__.__name__ == "DataFrame":
             return obj
 
-        p = re.compile(r'{}'.format(self.source_filter))
+        p = self.get_pattern("source_filter")
+        # Parsed tag keys for each matched tag string. The same tags tend to recur across trans-units.
+        parsed = dict()
+        changed = list()
 
         for element in obj:
 
-            source_matches = self.get_existing_tags_source(element, p)
+            source_tags = self.get_source_tag_inventory(element, p, parsed)
+            if not source_tags:
+                continue
+
+            # Build the target inventory in a single walk and look up
+            # missing tags as a set difference instead of querying the target for each match.
+            target = element.find("xliff:target", self.NAMESPACES)
+            target_tags = tag_inventory(target)
+            missing = [key for key in source_tags if key not in target_tags]
 
-            # For each matched tag in the source, create a new replacement element.
-            # If the same tag is missing from the target, we replace the first match
-            # with the corresponding element.
-            for i in range(len(source_matches)):
+            # For each tag that is missing from the target, create a new replacement element
+            # and replace the first match in the target with the corresponding element.
+            for key in missing:
 
-                replace = ET.fromstring(source_matches[i][0])
+                replace = ET.fromstring(source_tags[key])
                 if self.replace is not None:
                     replace.text = self.replace
 
                 # We iterate over the target segment child elements
                 # in case it contained subsegments/external/inline tags.
-                target = element.find("xliff:target", self.NAMESPACES).iter()
-                for substring in target:
+                for substring in target.iter():
 
-                    # Check for any existing elements that match the
-                    # replacement element and go to next match if True
-                    check = self.check_existing_tags_target(substring, replace)
-                    if check is True:
-                        break
-
-                    elif substring.text == replace.text:
+                    if substring.text == replace.text:
                         match = append_element(substring, replace, attrs=['tail'])
 
                     else:
                         match = append_element(substring, replace, attrs=['text', 'tail'])
 
                     if match:
+                        target_tags.add(key)
+                        if not changed or changed[-1] is not element:
+                            changed.append(element)
                         break
 
+        # Return only the trans-units that have been changed
+        return changed
+
     def get_existing_tags_source(self, element, p):
         """Search for matching tags in source element.
         Arguments:
@@ -241,22 +283,174 @@ class ApplyTagEntry(BaseEntry):
             m -- List of matches ([('match_1 group_1', ...'match_1 group_n'), ('match_n group_1', ...'match2 group_n')]
         """
 
-        # Convert source segment from element to a searchable string
+        # Convert source segment from element to a searchable string.
+        # The source filter is written against the serialized markup, e.g. '(<(\w+) [^>]+?>\d+%</\w+>)',
+        # and may match attributes, text around the tag and nested tags. Its first group is parsed
+        # as the tag to insert. A walk over the elements cannot reproduce these matches, so the
+        # serialization is kept. Parsing of the matched tag strings is cached by the caller.
         sub_element = element.find("xliff:seg-source", self.NAMESPACES)
         sub_element = ET.tostring(sub_element, encoding='utf-8').decode('utf-8')
-        m = re.findall(p, sub_element)
+        m = p.findall(sub_element)
 
         return m
 
-    def check_existing_tags_target(self, element, replace):
-        """Check if the target segment already contains the replacement candidate."""
+    def get_source_tag_inventory(self, element, p, parsed):
+        """Collect matching tags in source element keyed by tag name and attribute.
+
+        Arguments:
+            element -- Trans-unit element parsed from tree
+            p -- Regex pattern compiled from the object's source attribute
+            parsed -- Dictionary with tag strings as keys and tag keys as values, updated in place
+
+        Returns:
+            tags -- Dictionary with tag keys as keys and the first matching tag string as values
+        """
+        tags = dict()
+        for m in self.get_existing_tags_source(element, p):
+            string = m[0]
+            if string not in parsed:
+                parsed[string] = tag_key(ET.fromstring(string))
+            tags.setdefault(parsed[string], string)
+
+        return tags
+
+
+class TargetText(object):
+    """Text nodes of a target segment viewed as one logical string.
+
+    Inline tags split a segment into several text and tail nodes. Search expressions
+    and case changes run once on the joined string. Each edit is mapped back to the
+    node that holds it, so the tags stay in place. See target_segments() for how
+    a target is split into segments.
+
+    Attributes:
+        nodes -- List of (element, attribute) tuples for all non-empty nodes in document order
+        strings -- List of node strings
+        starts -- List of node offsets in the joined string
+        string -- Joined string
+    """
+
+    def __init__(self, nodes):
+        self.nodes = [(element, attr) for element, attr in nodes if getattr(element, attr)]
+        self.set_strings([getattr(element, attr) for element, attr in self.nodes])
+
+    def set_strings(self, strings):
+
+        self.strings = strings
+        self.starts = list()
+        offset = 0
+        for string in strings:
+            self.starts.append(offset)
+            offset += len(string)
+        self.string = ''.join(strings)
+
+    def locate(self, start, end):
+        """Return position of the node that holds the span [start, end) or None if the span crosses nodes."""
+
+        i = bisect_right(self.starts, start) - 1
+        if i < 0 or end > self.starts[i] + len(self.strings[i]):
+            return None
+
+        return i
+
+    def sub(self, pattern, repl):
+        """Replace all matches of a compiled regex.
+
+        Matches that span an inline tag are left unchanged.
+
+        Returns:
+            True if any node has been changed, else False
+        """
+        edits = [(m.start(), m.end(), m.expand(repl)) for m in pattern.finditer(self.string)]
+
+        return self.apply([edit for edit in edits if self.locate(edit[0], edit[1]) is not None])
+
+    def transform_prefix(self, n, func):
+        """Apply a string function, e.g. str.upper, to the first n characters.
+
+        The prefix is transformed as a whole and split at the original node boundaries.
+        If the function changes the length of the prefix, each node is transformed separately.
+
+        Returns:
+            True if any node has been changed, else False
+        """
+        prefix = self.string[:n]
+        update = func(prefix)
+
+        edits = list()
+        for i, start in enumerate(self.starts):
+            if start >= len(prefix):
+                break
+            end = min(start + len(self.strings[i]), len(prefix))
+            edits.append((start, end, update[start:end] if len(update) == len(prefix)
+                          else func(self.string[start:end])))
+
+        return self.apply(edits)
+
+    def apply(self, edits):
+        """Write (start, end, string) edits to the nodes. Edits must be sorted and must not overlap."""
+
+        strings = list(self.strings)
+        # Apply edits from the end so that the node offsets of the remaining edits stay valid
+        for start, end, update in reversed(edits):
+            i = self.locate(start, end)
+            offset = self.starts[i]
+            strings[i] = strings[i][:start - offset] + update + strings[i][end - offset:]
+
+        changed = False
+        for (element, attr), string, update in zip(self.nodes, self.strings, strings):
+            if update != string:
+                setattr(element, attr, update)
+                changed = True
+        self.set_strings(strings)
+
+        return changed
+
+
+def target_segments(target):
+    """Split a target element into one TargetText object per segment.
+
+    SDLXLIFF targets wrap each segment in <mrk mtype="seg">. Nodes are only joined within
+    a segment, so anchors and word boundaries still match at segment boundaries. Text
+    between segments forms its own strings. A target without segment markers is a
+    single segment.
+    """
+    mrk = "{urn:oasis:names:tc:xliff:document:1.2}mrk"
+    groups = [list()]
+    for element, attr in text_nodes(target):
+        # A segment starts with the text of its marker and ends before the tail
+        if element is not target and element.tag == mrk and element.get("mtype") == "seg":
+            groups.append(list())
+        groups[-1].append((element, attr))
+
+    return [TargetText(nodes) for nodes in groups]
+
+
+def text_nodes(element, tail=False):
+    """Yield (element, attribute) tuples for the text and tail nodes of an element in document order."""
+
+    # Comments and processing instructions only contribute their tail, as in itertext()
+    if isinstance(element.tag, str):
+        yield element, "text"
+        for child in element:
+            for node in text_nodes(child, tail=True):
+                yield node
+    if tail:
+        yield element, "tail"
+
+
+def tag_key(element):
+    """Key tags by local name and first attribute, e.g. ("g", "id", "5")."""
+
+    attrib = element.items()
+    name, value = attrib[0] if attrib else (None, None)
+    return ET.QName(element).localname, name, value
+
+
+def tag_inventory(element):
+    """Return the set of tag keys found in an element and its subelements."""
 
-        sub_element = element.find(".//xliff:{}[@{}='{}']".
-                                   format(replace.tag, replace.attrib.keys()[0],
-                                          replace.attrib.values()[0]), self.NAMESPACES)
-        # True if a match was found or if element string and replacement string are identical
-        match = sub_element is not None
-        return match
+    return {tag_key(sub_element) for sub_element in element.iter(ET.Element)}
 
 
 def append_element(element, replace, attrs):
@@ -0,0 +1,192 @@
+import heapq
+import re
+from difflib import SequenceMatcher
+
+from source.entries import SearchMTEntry
+from source.subs import PreprocSub
+
+TOKEN = re.compile(r'\w+|[^\w\s]')
+WORD = re.compile(r'\w')
+
+
+class SpaceSaving(object):
+    """Count the most frequent keys of a stream with bounded memory.
+
+    This is the Space-Saving algorithm: once the counter is full, a new key replaces the key
+    with the smallest count and inherits that count. The inherited count is stored as error bound.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.counts = dict()
+        self.errors = dict()
+        # Heap of (count, key) items. Items become stale when a count is increased.
+        self.heap = list()
+
+    def update(self, key, weight=1):
+
+        if key in self.counts:
+            self.counts[key] += weight
+
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = weight
+            self.errors[key] = 0
+
+        else:
+            minimum, victim = self.pop_min()
+            del self.counts[victim]
+            del self.errors[victim]
+            self.counts[key] = minimum + weight
+            self.errors[key] = minimum
+
+        heapq.heappush(self.heap, (self.counts[key], key))
+
+        # Drop stale items once the heap grows too large
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(count, k) for k, count in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_min(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return count, key
+
+    def top(self, k=None):
+        """Return list of (key, count, error) tuples sorted by count."""
+
+        items = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(key, count, self.errors[key]) for key, count in items]
+
+
+def tokenize(string, level="token"):
+    """Split a string into (token, start, end) tuples.
+
+    Arguments:
+        string -- Segment string
+        level -- "token" for words and punctuation or "char" for single characters
+    """
+    if level == "char":
+        return [(c, i, i + 1) for i, c in enumerate(string)]
+
+    return [(m.group(), m.start(), m.end()) for m in TOKEN.finditer(string)]
+
+
+def edit_candidates(mt, target, level="token", context=1, max_span=3):
+    """Derive search and replace candidates that turn the MT string into the target string.
+
+    Arguments:
+        mt -- MT string
+        target -- Post-edited target string
+        level -- Alignment level, "token" or "char"
+        context -- Number of unchanged tokens (or characters) added on each side of an edit
+        max_span -- Maximum number of changed tokens (or characters) on each side of an edit
+
+    Returns:
+        List of (search, replace) tuples. Search strings are regular expressions.
+    """
+    a = tokenize(mt, level)
+    b = tokenize(target, level)
+    opcodes = SequenceMatcher(None, [t[0] for t in a], [t[0] for t in b], autojunk=False).get_opcodes()
+
+    candidates = list()
+    for n, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == "equal" or i2 - i1 > max_span or j2 - j1 > max_span:
+            continue
+
+        # Context is taken from the neighbouring equal blocks, which are aligned one to one.
+        left = min(context, i1 - opcodes[n - 1][1]) if n > 0 and opcodes[n - 1][0] == "equal" else 0
+        right = min(context, opcodes[n + 1][2] - i2) if n + 1 < len(opcodes) and opcodes[n + 1][0] == "equal" else 0
+        i1, i2, j1, j2 = i1 - left, i2 + right, j1 - left, j2 + right
+
+        # Insertions without context cannot be anchored
+        if i1 == i2:
+            continue
+
+        start, end = a[i1][1], a[i2 - 1][2]
+        t_start, t_end = (b[j1][1], b[j2 - 1][2]) if j1 < j2 else (0, 0)
+        # Whitespace between tokens is not aligned. On a side without context,
+        # the gap to the next token is part of the edit, e.g. "A: b" -> "A - b".
+        if level != "char":
+            if not left:
+                start = a[i1 - 1][2] if i1 > 0 else 0
+                t_start = b[j1 - 1][2] if j1 > 0 else 0
+            if not right:
+                end = a[i2][1] if i2 < len(a) else len(mt)
+                t_end = b[j2][1] if j2 < len(b) else len(target)
+
+        replace = target[t_start:t_end]
+        candidates.append((to_pattern(mt, start, end), replace.replace("\\", "\\\\")))
+
+    return candidates
+
+
+def to_pattern(string, start, end):
+    """Escape a substring for use as search expression.
+
+    Word boundaries are added where the substring starts or ends at a word boundary of the string.
+    """
+    pattern = re.escape(string[start:end]).replace("\\ ", " ")
+    if WORD.match(string, start) and (start == 0 or not WORD.match(string, start - 1)):
+        pattern = r'\b' + pattern
+    if WORD.match(string, end - 1) and (end == len(string) or not WORD.match(string, end)):
+        pattern += r'\b'
+
+    return pattern
+
+
+def mine_entries(chunks, top_k=50, min_count=2, level="token", context=1, max_span=3, capacity=10000):
+    """Mine frequent post-edits from target and MT strings and return them as entries.
+
+    Arguments:
+        chunks -- DataFrame object with "target" and "mt" columns or an iterable of such objects,
+                  e.g. from table.read_chunks()
+        top_k -- Maximum number of entries
+        min_count -- Minimum number of occurrences of an edit
+        level -- Alignment level, "token" or "char"
+        context -- Number of unchanged tokens (or characters) added on each side of an edit
+        max_span -- Maximum number of changed tokens (or characters) on each side of an edit
+        capacity -- Number of candidates tracked by the top-k counter. Memory is bounded by this number.
+
+    Identical target-MT pairs are aligned only once per chunk and counted with their frequency.
+
+    Returns:
+        List of SearchMTEntry objects sorted by frequency
+    """
+    if chunks.__class__.__name__ == "DataFrame":
+        chunks = [chunks]
+
+    sketch = SpaceSaving(capacity)
+
+    for df in chunks:
+        pairs = df[df.target != df.mt].groupby(["mt", "target"]).size()
+        for (mt, target), count in pairs.items():
+            for candidate in edit_candidates(mt, target, level, context, max_span):
+                sketch.update(candidate, count)
+
+    entries = list()
+    for (search, replace), count, error in sketch.top():
+        if len(entries) == top_k or count < min_count:
+            break
+        entries.append(SearchMTEntry({"search": search, "replace": replace, "created_by": "mining",
+                                      "desc": "Mined: {} -> {} ({} occurrences)".format(search, replace, count - error)
+                                      }))
+
+    return entries
+
+
+def mine_rulebook(chunks, fp=None, desc=None, **kwargs):
+    """Mine entries (see mine_entries) and wrap them in a PreprocSub object.
+
+    Arguments:
+        chunks -- DataFrame object or iterable of DataFrame objects with "target" and "mt" columns
+        fp -- Optional path for saving the rulebook as JSON
+
+    Returns:
+        PreprocSub object
+    """
+    subs = PreprocSub(created_by="mining", desc=desc, entries=mine_entries(chunks, **kwargs))
+    if fp:
+        subs.convert_to_json(fp)
+
+    return subs
@@ -0,0 +1,236 @@
+import copy
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+
+from source.calculation import pe_density
+
+
+class RuleAnalysis(object):
+    """Match sets, conflicts and execution waves for a list of entries.
+
+    Attributes:
+        entries -- List of entries in serial order
+        assigned -- List of arrays with the rows or trans-unit positions each entry changes in serial order
+        conflicts -- Dictionary with (earlier entry, later entry) index tuples as keys and
+                     dictionaries {"overlap": positions, "chain": positions} as values
+        waves -- List of lists of entry indices. Entries in the same wave change disjoint rows.
+        codes -- Array with the position of each row's (source, MT) pair in the unique pairs (tables only)
+        updates -- List of Series with the MT strings written by each entry, indexed by unique pair position
+                   (tables only)
+    """
+
+    def __init__(self, entries, assigned, conflicts, codes=None, updates=None):
+        self.entries = entries
+        self.assigned = assigned
+        self.conflicts = conflicts
+        self.codes = codes
+        self.updates = updates
+        self.waves = build_waves(len(entries), conflicts)
+
+    def report(self):
+        """Describe conflicting entries for rulebook authors.
+
+        An overlap means that both entries match the same original string.
+        A chain means that the later entry only matches after the earlier entry has been applied.
+        """
+        lines = ["{} entries in {} waves, {} conflicts".format(len(self.entries), len(self.waves),
+                                                               len(self.conflicts))]
+
+        for (i, j), kinds in sorted(self.conflicts.items()):
+            for kind, positions in kinds.items():
+                if len(positions):
+                    lines.append("{}:\t[{}] {} -> [{}] {}\t({} items)".format(
+                        kind, i, self.entries[i].desc, j, self.entries[j].desc, len(positions)))
+
+        return "\n".join(lines)
+
+
+def build_waves(n, conflicts):
+    """Group entry indices into waves so that each entry runs after all entries it conflicts with."""
+
+    level = [0] * n
+    for i, j in sorted(conflicts, key=lambda pair: pair[1]):
+        level[j] = max(level[j], level[i] + 1)
+
+    waves = [list() for _ in range(max(level, default=-1) + 1)]
+    for j, wave in enumerate(level):
+        waves[wave].append(j)
+
+    return waves
+
+
+def footprint(entry, pairs):
+    """Return positions of the (source, MT) pairs changed by an entry and the updated pairs.
+
+    A pair counts as changed if its MT string changes or if the entry resets its virtual score,
+    since the distance of a reset row is recomputed.
+    """
+    # Fill the virtual column so that every reset score shows up as NaN.
+    probe = pairs.copy()
+    probe["virtual"] = 0.0
+    updated = entry.search_and_replace(probe)
+
+    before, after = pairs.mt, updated.mt
+    changed = (before != after).fillna(True) & ~(before.isna() & after.isna())
+    changed = changed.to_numpy(dtype=bool) | updated.virtual.isna().to_numpy()
+
+    return np.flatnonzero(changed), updated[["source", "mt"]]
+
+
+def find_conflicts(changed, match):
+    """Build conflict edges from the positions each entry changes in serial order.
+
+    Arguments:
+        changed -- List of arrays with the positions changed by each entry in serial order
+        match -- Function that takes an entry index and an array of positions and returns
+                 the positions at which the entry matches the original items
+
+    Each entry depends on the previous entry that changed the same position. An edge is
+    an overlap if both entries match the original item, otherwise a chain.
+
+    Returns:
+        conflicts -- Dictionary with (earlier entry, later entry) index tuples as keys and
+                     dictionaries {"overlap": positions, "chain": positions} as values
+    """
+    # Sorting by position keeps the serial order of the entries for each position.
+    ids = np.concatenate([np.full(len(positions), j) for j, positions in enumerate(changed)] + [[]]).astype(int)
+    positions = np.concatenate(changed + [[]]).astype(int)
+    order = np.argsort(positions, kind="stable")
+    ids, positions = ids[order], positions[order]
+    follows = positions[1:] == positions[:-1]
+    edges = pd.DataFrame({"i": ids[:-1][follows], "j": ids[1:][follows], "p": positions[1:][follows]})
+
+    matched = dict()
+    for j in np.union1d(edges.i, edges.j):
+        matched[j] = match(j, np.union1d(edges.p[edges.i == j], edges.p[edges.j == j]))
+
+    conflicts = dict()
+    for (i, j), group in edges.groupby(["i", "j"]):
+        overlap = np.isin(group.p, matched[i]) & np.isin(group.p, matched[j])
+        conflicts[(i, j)] = {"overlap": group.p[overlap].to_numpy(), "chain": group.p[~overlap].to_numpy()}
+
+    return conflicts
+
+
+def analyze_table(entries, df):
+    """Compute the rows each entry changes in serial order and the conflicts between entries.
+
+    Arguments:
+        entries -- List of entries
+        df -- DataFrame object with "source" and "mt" columns
+
+    Entries only depend on the source and MT string of a row. The entries are therefore
+    replayed serially on the unique (source, MT) pairs, and the changes are mapped back to
+    the rows. The replay only runs the search expressions. Distances are computed when the
+    entries are applied, see apply_table_in_waves().
+
+    Returns:
+        RuleAnalysis object
+    """
+    codes, uniques = pd.MultiIndex.from_arrays([df.source, df.mt]).factorize()
+    original = pd.DataFrame({"source": pd.Series(uniques.get_level_values(0)).astype(df.source.dtype),
+                             "mt": pd.Series(uniques.get_level_values(1)).astype(df.mt.dtype)})
+
+    state = original
+    changed = list()
+    updates = list()
+    for entry in entries:
+        positions, state = footprint(entry, state)
+        changed.append(positions)
+        updates.append(pd.Series(state.mt.iloc[positions].to_numpy(dtype=object), index=positions))
+
+    def match(j, candidates):
+        return candidates[footprint(entries[j], original.iloc[candidates].reset_index(drop=True))[0]]
+
+    conflicts = dict()
+    for key, kinds in find_conflicts(changed, match).items():
+        conflicts[key] = {kind: np.flatnonzero(np.isin(codes, positions)) for kind, positions in kinds.items()}
+
+    assigned = [np.flatnonzero(np.isin(codes, positions)) for positions in changed]
+
+    return RuleAnalysis(entries, assigned, conflicts, codes, updates)
+
+
+def analyze_units(entries, tus):
+    """Compute the trans-units each entry changes in serial order and the conflicts between entries.
+
+    Arguments:
+        entries -- List of entries
+        tus -- List of trans-unit elements. The elements are not changed.
+
+    The entries are applied serially to a copy of the trans-units, as in apply_to_units().
+    Trans-units are not scheduled in waves, since lxml does not support concurrent changes
+    to one document. The analysis only serves the conflict report.
+
+    Returns:
+        RuleAnalysis object with trans-unit positions instead of rows
+    """
+    copies = [copy.deepcopy(tu) for tu in tus]
+    positions = {id(tu): pos for pos, tu in enumerate(copies)}
+
+    changed = list()
+    for entry in entries:
+        changed.append(np.array(sorted({positions[id(tu)] for tu in entry.search_and_replace(copies)}), dtype=int))
+
+    def match(j, candidates):
+        originals = [copy.deepcopy(tus[pos]) for pos in candidates]
+        matched = {id(tu) for tu in entries[j].search_and_replace(originals)}
+        return candidates[[id(tu) in matched for tu in originals]]
+
+    return RuleAnalysis(entries, changed, find_conflicts(changed, match))
+
+
+def apply_table_in_waves(df, analysis, max_workers=None):
+    """Apply entries wave by wave and compute the distances of each wave in worker processes.
+
+    Arguments:
+        df -- DataFrame object the analysis was computed on
+        analysis -- RuleAnalysis object from analyze_table()
+        max_workers -- Number of worker processes for the Levenshtein distances.
+                       Defaults to the number of CPUs. With a single worker no processes are started.
+
+    The MT strings written by each entry are taken from the analysis, so the search
+    expressions do not run again. Entries of the same wave change disjoint rows, so
+    the distances of all rows changed in a wave are computed in one batch.
+
+    Returns:
+        df -- Updated DataFrame
+        sums -- List of (Levenshtein distance, maximum length) tuples, see PreprocSub.apply_entries
+    """
+    entries = analysis.entries
+    max_workers = (os.cpu_count() or 1) if max_workers is None else max_workers
+
+    with ProcessPoolExecutor(max_workers) if max_workers > 1 else nullcontext() as pool:
+        _, df = pe_density(df, pool)
+        baseline = (df['lev'].sum(), df['max_char'].sum())
+        deltas = [(0, 0)] * len(entries)
+        virtual = df.columns.get_loc("virtual")
+        mt = df.mt.to_numpy(dtype=object, copy=True)
+
+        for wave in analysis.waves:
+            jobs = [(j, analysis.assigned[j]) for j in wave if len(analysis.assigned[j])]
+            if not jobs:
+                continue
+
+            before = [(df['lev'].iloc[rows].sum(), df['max_char'].iloc[rows].sum()) for _, rows in jobs]
+            for j, rows in jobs:
+                mt[rows] = analysis.updates[j].reindex(analysis.codes[rows]).to_numpy(dtype=object)
+                df.iloc[rows, virtual] = np.nan
+            # Arrow-backed columns do not support assignment to scattered positions in all pandas versions.
+            df["mt"] = pd.array(mt, dtype=df.mt.dtype)
+
+            # Recompute PED for all rows of the wave at once
+            _, df = pe_density(df, pool)
+            for (j, rows), (lev, max_char) in zip(jobs, before):
+                deltas[j] = (df['lev'].iloc[rows].sum() - lev, df['max_char'].iloc[rows].sum() - max_char)
+
+    # Rebuild the PED components after each entry in serial order
+    sums = [baseline]
+    for lev, max_char in deltas:
+        sums.append((sums[-1][0] + lev, sums[-1][1] + max_char))
+
+    return df, sums
@@ -0,0 +1,169 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+
+from source.calculation import pe_density
+
+
+def bootstrap_ped(df, cat_column=None, n_resamples=10000, ci=0.95, seed=None):
+    """Compute bootstrap confidence intervals for the aggregated PED score.
+
+    Arguments:
+        df -- DataFrame with PED data. The "lev" and "max_char" columns are computed if missing.
+        cat_column -- String; categorical variable for computing one interval per group (e.g. "t_lid")
+        n_resamples -- Number of bootstrap resamples
+        ci -- Confidence level of the interval
+        seed -- Seed for the random number generator
+
+    The aggregated PED is the ratio of the summed Levenshtein distances and the summed
+    maximum segment lengths. Each resample draws the same number of segments with replacement.
+
+    Returns:
+        DataFrame with the columns "segments", "ped", "lower" and "upper" and one row per group
+    """
+    lev, max_char = get_ped_components(df)
+    rng = np.random.default_rng(seed)
+    alpha = (1 - ci) / 2
+
+    rows = dict()
+    for name, idx in iter_groups(df, cat_column):
+        peds = resample_ped(lev[idx], max_char[idx], n_resamples, rng)
+        rows[name] = {"segments": len(idx),
+                      "ped": lev[idx].sum() / max_char[idx].sum() if len(idx) else np.nan,
+                      "lower": np.quantile(peds, alpha),
+                      "upper": np.quantile(peds, 1 - alpha)
+                      }
+
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def compare_groups(df, cat_column, n_resamples=10000, ci=0.95, seed=None):
+    """Compute bootstrap confidence intervals for PED differences between pairs of groups.
+
+    Arguments:
+        df -- DataFrame with PED data. The "lev" and "max_char" columns are computed if missing.
+        cat_column -- String; categorical variable defining the groups (e.g. "Relation", "t_lid")
+        n_resamples -- Number of bootstrap resamples
+        ci -- Confidence level of the interval
+        seed -- Seed for the random number generator
+
+    For each pair of groups, the difference of the resampled PED scores is computed resample
+    by resample. The p-value is the two-sided share of resampled differences on the other side of zero.
+
+    Returns:
+        DataFrame with the columns "diff", "lower", "upper" and "p_value" indexed by group pairs
+    """
+    lev, max_char = get_ped_components(df)
+    rng = np.random.default_rng(seed)
+    alpha = (1 - ci) / 2
+
+    groups = list(iter_groups(df, cat_column))
+    peds = {name: resample_ped(lev[idx], max_char[idx], n_resamples, rng) for name, idx in groups}
+    point = {name: lev[idx].sum() / max_char[idx].sum() for name, idx in groups}
+
+    rows = dict()
+    for a, b in combinations(peds, 2):
+        diff = peds[a] - peds[b]
+        rows[(a, b)] = {"diff": point[a] - point[b],
+                        "lower": np.quantile(diff, alpha),
+                        "upper": np.quantile(diff, 1 - alpha),
+                        "p_value": min(1.0, 2 * min((diff <= 0).mean(), (diff >= 0).mean()))
+                        }
+
+    return pd.DataFrame.from_dict(rows, orient="index")
+
+
+def get_ped_components(df):
+    """Return Levenshtein distances and maximum lengths as NumPy arrays."""
+
+    if "lev" not in df.columns or "max_char" not in df.columns:
+        _, df = pe_density(df.copy())
+
+    return df["lev"].to_numpy(dtype=float), df["max_char"].to_numpy(dtype=float)
+
+
+def iter_groups(df, cat_column=None):
+    """Yield group names and positional row indices."""
+
+    if cat_column is None:
+        yield "All", np.arange(len(df))
+    else:
+        for name, idx in df.groupby(cat_column).indices.items():
+            yield name, idx
+
+
+def resample_ped(lev, max_char, n_resamples=10000, rng=None, max_cells=10 ** 7, max_exact=1000):
+    """Draw bootstrap resamples of the aggregated PED score.
+
+    Arguments:
+        lev -- Array of Levenshtein distances
+        max_char -- Array of maximum segment lengths
+        n_resamples -- Number of bootstrap resamples
+        rng -- NumPy random Generator
+        max_cells -- Upper bound for the size of the resample matrix held in memory at once
+        max_exact -- Maximum number of unique (distance, length) pairs drawn one by one
+
+    Segments with identical distance and length are interchangeable, so we resample counts
+    per unique pair. If there are at most max_exact unique pairs, the counts are drawn from a
+    multinomial distribution (or as an index matrix if there are no duplicates).
+
+    Larger inputs use the Poisson bootstrap: each unique pair occurs Poisson(count) times.
+    The rarest max_exact pairs are drawn exactly. The summed distances and lengths of all
+    other pairs are drawn from a bivariate normal distribution with the same mean and covariance
+    as their Poisson sums. This keeps the cost per resample independent of the input size.
+
+    Returns:
+        Array of n_resamples PED scores. All scores are NaN if there are no segments.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    n = len(lev)
+    if n == 0:
+        return np.full(n_resamples, np.nan)
+
+    pairs, counts = unique_pairs(lev, max_char)
+    compressed = len(pairs) < n
+    large = len(pairs) > max_exact
+
+    if large:
+        # Pairs sorted by count. The rarest pairs are drawn exactly, the others jointly.
+        order = np.argsort(counts, kind="stable")
+        exact, rest = order[:max_exact], order[max_exact:]
+        mean = counts[rest] @ pairs[rest]
+        cov = (pairs[rest] * counts[rest, None]).T @ pairs[rest]
+
+    width = max_exact if large else len(pairs) if compressed else n
+    batch = max(1, max_cells // max(width, 1))
+
+    peds = np.empty(n_resamples)
+    for start in range(0, n_resamples, batch):
+        size = min(batch, n_resamples - start)
+
+        if large:
+            sums = rng.poisson(counts[exact], size=(size, len(exact))) @ pairs[exact]
+            sums = sums + rng.multivariate_normal(mean, cov, size=size)
+            peds[start:start + size] = sums[:, 0] / sums[:, 1]
+        elif compressed:
+            # Matrix of resample counts with one row per resample and one column per unique pair
+            weights = rng.multinomial(n, counts / n, size=size)
+            peds[start:start + size] = (weights @ pairs[:, 0]) / (weights @ pairs[:, 1])
+        else:
+            # Matrix of resampled segment indices with one row per resample
+            idx = rng.integers(0, n, size=(size, n))
+            peds[start:start + size] = lev[idx].sum(axis=1) / max_char[idx].sum(axis=1)
+
+    return peds
+
+
+def unique_pairs(lev, max_char):
+    """Return unique (distance, length) pairs sorted by distance and length, and their counts."""
+
+    # Distances and lengths are counts of characters. Encoding each pair as a single number
+    # is much faster than np.unique over rows.
+    scale = max_char.max() + 1
+    if (lev >= 0).all() and (max_char >= 0).all() and (lev.max() + 1) * scale < 2 ** 53 \
+            and (lev % 1 == 0).all() and (max_char % 1 == 0).all():
+        keys, counts = np.unique(lev * scale + max_char, return_counts=True)
+        return np.column_stack([keys // scale, keys % scale]), counts
+
+    return np.unique(np.column_stack([lev, max_char]), axis=0, return_counts=True)
@@ -1,6 +1,8 @@
 import os
 import re
 import logging
+from collections import OrderedDict
+
 import pandas as pd
 
 # Prevent Pandas from truncating strings that are too long.
@@ -8,9 +10,29 @@ pd.set_option('display.expand_frame_repr', False)
 pd.set_option('max_colwidth', -1)
 
 
+COLUMNS = ["Project", "Relation", "Document", "s_lid", "t_lid", "score", "source", "target", "mt"]
+STRING_COLUMNS = ["source", "target", "mt"]
+# String dtype backed by contiguous Arrow buffers (requires pyarrow)
+ARROW_STRING = "string[pyarrow]"
+# Regex features with different semantics in Python and RE2, the engine of the Arrow kernels.
+# Word boundaries and character classes are ASCII-only in RE2.
+RE2_UNSAFE = re.compile(r'\\[0bBwWdDsSgZAz]|\$|\(\?[^:]')
+# Excel allows 1,048,576 rows per sheet, including the header
+EXCEL_MAX_ROWS = 1000000
+# Each Excel sheet keeps a temporary file open while it is written in constant memory mode
+EXCEL_MAX_OPEN_SHEETS = 64
+# Sheet names are limited to 31 characters and must not contain any of these characters
+SHEET_NAME_INVALID = re.compile(r'[\[\]:*?/\\]')
+
+
 def load_json(fp):
 
     df = pd.read_json(fp, orient="records", encoding='utf-8')
+
+    return split_ped_details(df)
+
+
+def split_ped_details(df):
     # Convert ped_detail dictionary to list
     df.ped_details = df.ped_details.apply(lambda x: [x['score'], x['source'], x['target'], x['mt']])
     headers = ['score', 'source', 'target', 'mt']
@@ -19,15 +41,74 @@ def load_json(fp):
     return df
 
 
+def clean_columns(df):
+    """Drop the raw PED columns from report data and apply the default column order."""
+
+    if "ped" in df.columns and "ped_details" in df.columns:
+        df = df.drop(["ped", "ped_details"], axis=1).reindex(columns=COLUMNS)
+
+    return df
+
+
 def load_csv(fp):
     return pd.read_csv(fp, encoding="utf-8", index_col=0)
 
 
-def create_df(directory):
-    """Create DataFrame from archived JSON files."""
+def to_string_dtype(df, dtype=ARROW_STRING):
+    """Convert the "source", "target" and "mt" columns to a string dtype, e.g. Arrow-backed strings."""
+
+    columns = [col for col in STRING_COLUMNS if col in df.columns]
+    return df.astype({col: dtype for col in columns})
+
+
+def is_arrow(series):
+    """Check if a Series holds Arrow-backed data."""
+    return getattr(series.dtype, "storage", None) == "pyarrow" or hasattr(series.dtype, "pyarrow_dtype")
+
+
+def str_contains(series, p):
+    """Search compiled regex in a Series of strings.
+
+    Arrow-backed strings are searched by a compiled Arrow kernel if the pattern has the same
+    meaning in RE2. Otherwise, we fall back to Python's re module.
+    """
+    if is_arrow(series) and not RE2_UNSAFE.search(p.pattern) and not p.flags & ~re.UNICODE:
+        try:
+            return series.str.contains(p.pattern, regex=True)
+        except (ValueError, NotImplementedError):
+            pass
+
+    if is_arrow(series):
+        return series.astype(object).str.contains(p, regex=True).astype("boolean")
+
+    return series.str.contains(p, regex=True)
+
+
+def str_replace(series, p, repl):
+    """Replace compiled regex in a Series of strings, see str_contains."""
+
+    if is_arrow(series) and not RE2_UNSAFE.search(p.pattern) and not RE2_UNSAFE.search(repl) \
+            and not p.flags & ~re.UNICODE:
+        try:
+            return series.str.replace(p.pattern, repl, regex=True)
+        except (ValueError, NotImplementedError):
+            pass
+
+    if is_arrow(series):
+        return series.astype(object).str.replace(p, repl, regex=True).astype(series.dtype)
 
-    columns = ["Project", "Relation", "Document", "s_lid", "t_lid", "score", "source", "target", "mt"]
-    df = pd.DataFrame(columns=columns)
+    return series.str.replace(p, repl, regex=True)
+
+
+def create_df(directory, string_dtype=None):
+    """Create DataFrame from archived JSON files.
+
+    Arguments:
+        directory -- Directory with archived JSON/CSV reports
+        string_dtype -- Optional dtype for the string columns, e.g. ARROW_STRING
+    """
+
+    df = pd.DataFrame(columns=COLUMNS)
 
     for file in os.listdir(directory):
         logging.info("Loading: {}".format(file))
@@ -41,12 +122,108 @@ def create_df(directory):
             fp = os.path.join(directory, file)
             df = df.append(load_csv(fp), ignore_index=True, sort=False)
 
-    if "ped" in df.columns and "ped_details" in df.columns:
-        df = df.drop(["ped", "ped_details"], axis=1).reindex(columns=columns)
+    df = clean_columns(df)
+    if string_dtype:
+        df = to_string_dtype(df, string_dtype)
 
     return df
 
 
+def file_type(fp, types):
+    """Return the lowercase extension of a path, e.g. ".csv". Raise ValueError if it is not in types."""
+
+    ext = os.path.splitext(fp)[1].lower()
+    if ext not in types:
+        raise ValueError("Unsupported file type: {} (expected {})".format(fp, ", ".join(types)))
+
+    return ext
+
+
+def read_chunks(fp, chunksize=100000, string_dtype=None):
+    """Read a table from disk in chunks without loading all rows into memory.
+
+    Arguments:
+        fp -- Path to a CSV file, a JSON lines file (".jsonl"), a Parquet file or
+              a directory of archived JSON/CSV reports as read by create_df()
+        chunksize -- Maximum number of rows per chunk
+        string_dtype -- Optional dtype for the string columns, e.g. ARROW_STRING
+
+    Note that archived JSON reports are read one file at a time.
+
+    Yields:
+        DataFrame objects with at most chunksize rows
+    """
+    if string_dtype:
+        for df in read_chunks(fp, chunksize):
+            yield to_string_dtype(df, string_dtype)
+        return
+
+    if os.path.isdir(fp):
+        for file in sorted(os.listdir(fp)):
+            logging.info("Loading: {}".format(file))
+
+            if file.lower().endswith(".json"):
+                df = clean_columns(load_json(os.path.join(fp, file)))
+                for start in range(0, len(df), chunksize):
+                    yield df.iloc[start:start + chunksize]
+
+            elif file.lower().endswith(".csv"):
+                yield from read_chunks(os.path.join(fp, file), chunksize)
+
+        return
+
+    ext = file_type(fp, (".csv", ".jsonl", ".parquet"))
+
+    if ext == ".csv":
+        yield from pd.read_csv(fp, encoding="utf-8", index_col=0, chunksize=chunksize)
+
+    elif ext == ".jsonl":
+        for df in pd.read_json(fp, orient="records", lines=True, encoding="utf-8", chunksize=chunksize):
+            if "ped_details" in df.columns:
+                df = clean_columns(split_ped_details(df))
+            yield df
+
+    else:
+        # Optional dependency for columnar caches
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(fp).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+
+
+def save_chunks(chunks, fp):
+    """Write chunks of a table to a single CSV or Parquet file.
+
+    Arguments:
+        chunks -- Iterable of DataFrame objects with identical columns
+        fp -- Path to output file (".csv" or ".parquet"). Other extensions raise a ValueError.
+
+    Returns:
+        Number of rows written
+    """
+    ext = file_type(fp, (".csv", ".parquet"))
+    rows = 0
+    writer = None
+
+    for i, df in enumerate(chunks):
+        if ext == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(fp, table.schema)
+            writer.write_table(table)
+        else:
+            df.to_csv(fp, mode='w' if i == 0 else 'a', header=i == 0, encoding="utf-8")
+        rows += len(df)
+
+    if writer is not None:
+        writer.close()
+
+    return rows
+
+
 def build_query(filter_dict):
     """
     Arguments:
@@ -98,12 +275,160 @@ def filter_items(exp, data, col="mt"):
 
     p = re.compile(r'{}'.format(exp))
     
-    my_filter = data[col].str.contains(p, regex=True)
+    my_filter = str_contains(data[col], p)
     return data[my_filter]
 
 
+def map_unique(series, func):
+    """Apply a function to the unique values of a Series only and map the results back to all rows.
+
+    Arguments:
+        series -- Series object, e.g. the "mt" column
+        func -- Function that takes a Series object and returns a Series object of the same length
+
+    MT output is highly repetitive, so string operations on the unique values
+    reduce the work by the duplication factor.
+
+    Returns:
+        Series object with the same index as the input. Missing values are mapped to NaN.
+    """
+    codes, uniques = pd.factorize(series)
+    result = func(pd.Series(uniques)).reset_index(drop=True)
+    # Codes of missing values are -1 and are reindexed to NaN.
+    result = result.reindex(codes)
+    result.index = series.index
+
+    return result
+
+
 def save_to_excel(df, fp):
+    """Save a DataFrame as Excel file, see export_report."""
+    export_report(df, fp)
+
+
+def export_report(chunks, fp, split_by=None, max_rows=EXCEL_MAX_ROWS, chunksize=100000,
+                  max_open_sheets=EXCEL_MAX_OPEN_SHEETS):
+    """Write a report to an Excel, CSV or Parquet file without holding the whole file in memory.
+
+    Arguments:
+        chunks -- DataFrame object or iterable of DataFrame objects with identical columns,
+                  e.g. from read_chunks()
+        fp -- Path to output file (".xlsx", ".csv" or ".parquet"). Other extensions raise a ValueError.
+        split_by -- Optional column for writing one Excel sheet per value, e.g. "Project" or "Relation"
+        max_rows -- Maximum number of data rows per Excel sheet. Larger groups continue on a new sheet.
+        chunksize -- Number of rows converted at once when writing a DataFrame object
+        max_open_sheets -- Maximum number of sheets with an open temporary file
+
+    Excel files are written in constant memory mode: each row is flushed to a temporary
+    file of its sheet once the next row is started. Rows of a chunk are written group by group.
+    The temporary files of the least recently written sheets are closed and reopened on demand,
+    so reports split into many groups do not run out of file handles.
+    CSV and Parquet files are written chunk by chunk (see save_chunks).
+
+    Returns:
+        Dictionary with sheet names as keys and numbers of data rows as values.
+        CSV and Parquet files count as a single sheet named after the file.
+    """
+    if chunks.__class__.__name__ == "DataFrame":
+        frame = chunks
+        chunks = (frame.iloc[i:i + chunksize] for i in range(0, max(len(frame), 1), chunksize))
+
+    if file_type(fp, (".xlsx", ".csv", ".parquet")) != ".xlsx":
+        return {os.path.basename(fp): save_chunks(chunks, fp)}
+
+    import xlsxwriter
+    from xlsxwriter.exceptions import FileCreateError
+
+    can_close = can_close_sheets()
+
+    # Strings are written as they are, e.g. MT strings starting with "=" are no formulas.
+    workbook = xlsxwriter.Workbook(fp, {"constant_memory": True, "strings_to_formulas": False,
+                                        "strings_to_urls": False, "strings_to_numbers": False})
+    # Current sheet, next row and number of sheets for each group
+    sheets = dict()
+    rows = dict()
+    # Sheets with an open temporary file, least recently written first
+    open_sheets = OrderedDict()
+
+    def next_sheet(group, columns):
+        count = sheets[group][2] + 1 if group in sheets else 1
+        name = sheet_name("Sheet1" if split_by is None else group, count, rows)
+        worksheet = workbook.add_worksheet(name)
+        worksheet.write_row(0, 0, columns)
+        sheets[group] = [worksheet, 1, count]
+        rows[name] = 0
+
+    def activate(worksheet):
+        if worksheet.name in open_sheets:
+            open_sheets.move_to_end(worksheet.name)
+            return
+        if not can_close:
+            open_sheets[worksheet.name] = worksheet
+            if len(open_sheets) == max_open_sheets + 1:
+                logging.warning("xlsxwriter {} cannot close sheet files, more than {} sheets stay open".format(
+                    xlsxwriter.__version__, max_open_sheets))
+            return
+        # xlsxwriter reopens the temporary files of all sheets when the workbook is closed
+        worksheet._opt_reopen()
+        open_sheets[worksheet.name] = worksheet
+        while len(open_sheets) > max_open_sheets:
+            open_sheets.popitem(last=False)[1]._opt_close()
+
+    try:
+        try:
+            for df in chunks:
+                columns = [df.index.name or ""] + [str(col) for col in df.columns]
+                # Missing values are written as blank cells.
+                df = df.astype(object).where(df.notna(), None)
+                groups = df.groupby(split_by, sort=False, dropna=False) if split_by else [(None, df)]
+
+                for group, part in groups:
+                    group = "nan" if split_by and pd.isna(group) else group
+                    for row in part.itertuples(name=None):
+                        if group not in sheets or sheets[group][1] > max_rows:
+                            next_sheet(group, columns)
+                        worksheet, n, _ = sheets[group]
+                        activate(worksheet)
+                        worksheet.write_row(n, 0, row)
+                        sheets[group][1] += 1
+                        rows[worksheet.name] += 1
+        finally:
+            workbook.close()
+    except (OSError, FileCreateError) as e:
+        if can_close or len(open_sheets) <= max_open_sheets:
+            raise
+        raise OSError("Could not keep {} Excel sheets open: xlsxwriter {} cannot close sheet files. Raise the "
+                      "open file limit, split the report by a coarser column or export to CSV or Parquet."
+                      .format(len(open_sheets), xlsxwriter.__version__)) from e
+
+    return rows
+
+
+def can_close_sheets():
+    """Check if xlsxwriter can close and reopen the temporary file of a sheet in constant memory mode.
+
+    The hooks are private. xlsxwriter calls them itself when the workbook is packaged (tested
+    with xlsxwriter 3.x). Without them, the temporary files of all sheets stay open until the
+    workbook is closed.
+    """
+    from xlsxwriter.worksheet import Worksheet
+
+    return hasattr(Worksheet, "_opt_close") and hasattr(Worksheet, "_opt_reopen")
+
+
+def sheet_name(name, count=1, existing=()):
+    """Return a valid and unique Excel sheet name. Sheets after the first of a group get a counter."""
+
+    name = SHEET_NAME_INVALID.sub("_", str(name)).strip("'") or "Sheet"
+    suffix = " ({})".format(count) if count > 1 else ""
+    name = name[:31 - len(suffix)] + suffix
+
+    # Excel compares sheet names case-insensitively
+    taken = {key.lower() for key in existing}
+    unique, n = name, 1
+    while unique.lower() in taken:
+        n += 1
+        tag = "~{}".format(n)
+        unique = name[:31 - len(tag)] + tag
 
-    writer = pd.ExcelWriter(fp)
-    df.to_excel(writer)
-    writer.save()
+    return unique
@@ -1,13 +1,10 @@
-import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sb
 import os
 
 from zipfile import ZipFile
 import sys
 
 
-def plot(df, cat_column=None, kde=True, save=False, color=None, ped=None, linewidth=5, fontsize=20):
+def plot(df, cat_column=None, kde=True, save=False, color=None, ped=None, linewidth=5, fontsize=20, ped_ci=None):
     """Plot PED score data as histogram.
     
     Arguments:
@@ -18,7 +15,13 @@ def plot(df, cat_column=None, kde=True, save=False, color=None, ped=None, linewi
         kde -- Boolean; controls kernel density estimation and ticks on y axis
         save -- String specifying path to save file
         color -- String specifying the line color ("r", "b", "g", etc.)
+        ped_ci -- Tuple with lower and upper bound of the aggregated score, e.g. from significance.bootstrap_ped
     """
+    # Plotting libraries are imported here to keep other imports from this module fast.
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import seaborn as sb
+
     if len(df) == 0:
         return print("Not enough data.")
     step = 0.05
@@ -46,7 +49,15 @@ def plot(df, cat_column=None, kde=True, save=False, color=None, ped=None, linewi
     
     # Note that the aggregated score does not account for different segment length
     if ped:
-        g.set_xlabels('Post-edit density (Agg. score: {:.3f})'.format(round(ped, 3)), fontsize=fontsize)
+        if ped_ci is not None:
+            g.set_xlabels('Post-edit density (Agg. score: {:.3f}, CI: {:.3f}-{:.3f})'.format(round(ped, 3), *ped_ci),
+                          fontsize=fontsize)
+        else:
+            g.set_xlabels('Post-edit density (Agg. score: {:.3f})'.format(round(ped, 3)), fontsize=fontsize)
+    # Shade the confidence interval of the aggregated score
+    if ped_ci is not None:
+        for ax in g.axes.flat:
+            ax.axvspan(*ped_ci, color="grey", alpha=0.3)
     g.fig.suptitle("Distribution of PED segment scores", fontsize=fontsize)
     g.add_legend(fontsize=fontsize)
     
@@ -103,8 +114,8 @@ def obj_to_dict(obj):
                 "__module__": obj.__module__
                 }
 
-    #  Populate the dictionary with object properties
-    obj_dict.update(obj.__dict__)
+    #  Populate the dictionary with object properties, leaving out private attributes like compiled patterns
+    obj_dict.update({k: v for k, v in obj.__dict__.items() if not k.startswith("_")})
 
     _ = obj_dict.pop("NAMESPACES", None)
 
@@ -133,7 +144,7 @@ def unzip_sample(dir_name, fn="sample_files.zip"):
     return fps
 
 
-def retrieve_file_paths(directory):
+def retrieve_file_paths(directory, backup=True):
     # setup file paths variable
     fps = []
     # Read all directory, subdirectories and file lists
@@ -142,7 +153,9 @@ def retrieve_file_paths(directory):
             fps.append(os.path.join(root, filename))
 
     if len(fps) > 0:
-        create_backup(directory, fps)
+        # Back up the files before they are changed in place
+        if backup:
+            create_backup(directory, fps)
         return fps
 
     else:
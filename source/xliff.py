@@ -1,10 +1,24 @@
 from lxml import etree as ET
+import copy
+import json
+import os
 import pprint
+import re
+import shutil
 
 NAMESPACES = {'xliff': 'urn:oasis:names:tc:xliff:document:1.2',
               'sdl': 'http://sdl.com/FileTypes/SdlXliff/1.0'
               }
 
+# Byte patterns used for scanning raw SDLXLIFF files without parsing them.
+ROOT_TAG = re.compile(rb'<xliff\b[^>]*>')
+NS_DECL = re.compile(rb'\bxmlns(?::\w+)?="[^"]*"')
+TU_START = re.compile(rb'<trans-unit[\s>]')
+TU_END = b'</trans-unit>'
+TU_ID = re.compile(rb'\sid="([^"]*)"')
+# Segment definitions are grandchildren of the trans-unit (see create_tree)
+MT_ORIGIN = re.compile(rb'<\w+:seg\s[^>]*\borigin="mt"')
+
 
 def create_tree(fp):
     tree = ET.parse(fp)
@@ -15,11 +29,207 @@ def create_tree(fp):
 
 
 def print_sample_from_file(fp, tu_id):
-    _, tus = create_tree(fp)
-    print_sample(tus, tu_id)
+    print_sample([load_unit(fp, tu_id)], 0)
 
 
 def print_sample(tus, tu_id):
     sample = ET.tostring(tus[tu_id], encoding='utf-8', pretty_print=True).decode('utf-8')
     pp = pprint.PrettyPrinter(indent=4, width=120)
     pp.pprint(sample)
+
+
+def index_path(fp):
+    """Return the path of the sidecar index for a SDLXLIFF file."""
+    return fp + ".idx.json"
+
+
+def build_index(fp, chunk_size=1 << 20):
+    """Map MT trans-units to their byte offsets in one streaming pass over the file.
+
+    Arguments:
+        fp -- Path to SDLXLIFF file
+        chunk_size -- Number of bytes read per iteration
+
+    The index stores the file size and mtime so that it can be invalidated once the file
+    has been changed. Units are listed in the same order as returned by create_tree().
+
+    Returns:
+        index -- Dictionary with file stats, namespace declarations, a list of
+                 [trans-unit ID, start offset, end offset] items and a dictionary
+                 mapping trans-unit IDs to their positions in that list
+    """
+    stat = os.stat(fp)
+    index = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "ns": None, "units": [], "ids": {}}
+
+    with open(fp, 'rb') as f:
+        buffer = b''
+        # Absolute offset of the first byte in the buffer
+        offset = 0
+        # Scan position and start of the current trans-unit, if any, in the buffer
+        pos = 0
+        start = None
+
+        while True:
+            chunk = f.read(chunk_size)
+            buffer += chunk
+
+            if index["ns"] is None:
+                m = ROOT_TAG.search(buffer)
+                if m:
+                    index["ns"] = b' '.join(NS_DECL.findall(m.group())).decode('utf-8')
+
+            while True:
+                if start is None:
+                    m = TU_START.search(buffer, pos)
+                    if m is None:
+                        break
+                    start = pos = m.start()
+                else:
+                    end = buffer.find(TU_END, pos)
+                    if end == -1:
+                        break
+                    end += len(TU_END)
+                    # Search the unit in place instead of slicing it out of the buffer
+                    if MT_ORIGIN.search(buffer, start, end):
+                        tu_id = TU_ID.search(buffer, start, buffer.index(b'>', start))
+                        tu_id = tu_id.group(1).decode('utf-8') if tu_id else None
+                        if tu_id is not None:
+                            index["ids"].setdefault(tu_id, len(index["units"]))
+                        index["units"].append([tu_id, offset + start, offset + end])
+                    start = None
+                    pos = end
+
+            if not chunk:
+                break
+
+            # Tags that were split between two chunks start within the last len(TU_END) bytes
+            pos = max(pos, len(buffer) - len(TU_END))
+            # Drop everything that has been scanned once per chunk. The root tag is kept until it is found.
+            if index["ns"] is not None:
+                cut = pos if start is None else start
+                buffer = buffer[cut:]
+                offset += cut
+                pos -= cut
+                start = None if start is None else start - cut
+
+    return index
+
+
+def load_index(fp):
+    """Load the sidecar index for a file and rebuild it if the file has changed."""
+
+    stat = os.stat(fp)
+    try:
+        with open(index_path(fp), 'r', encoding="utf-8") as f:
+            index = json.load(f)
+        if index["size"] == stat.st_size and index["mtime"] == stat.st_mtime_ns and "ids" in index:
+            return index
+    except (OSError, ValueError, KeyError):
+        pass
+
+    index = build_index(fp)
+    save_index(fp, index)
+    return index
+
+
+def save_index(fp, index):
+
+    try:
+        with open(index_path(fp), 'w', encoding="utf-8") as f:
+            json.dump(index, f)
+    except OSError:
+        # The sidecar is optional, e.g. if the file is stored in a read-only location.
+        # The index is then only kept in memory.
+        pass
+
+
+def find_unit(index, tu_id):
+    """Return position of a trans-unit in the index by ordinal (int) or trans-unit ID (str)."""
+
+    if isinstance(tu_id, int):
+        return tu_id
+
+    return index["ids"][tu_id]
+
+
+def load_unit(fp, tu_id, index=None):
+    """Parse a single trans-unit by seeking to its byte offsets.
+
+    Arguments:
+        fp -- Path to SDLXLIFF file
+        tu_id -- Ordinal of the MT trans-unit (int) or its "id" attribute (str)
+        index -- Optional index returned by load_index()
+
+    Returns:
+        Trans-unit element. Its parent is a wrapper element holding the namespace declarations of the file.
+    """
+    index = load_index(fp) if index is None else index
+    _, start, end = index["units"][find_unit(index, tu_id)]
+
+    with open(fp, 'rb') as f:
+        f.seek(start)
+        fragment = f.read(end - start)
+
+    return parse_fragment(fragment, index["ns"])
+
+
+def parse_fragment(fragment, ns):
+    # Wrap the fragment so that namespace prefixes used by the trans-unit are resolved.
+    wrapper = ET.fromstring('<fragment {}>'.format(ns).encode('utf-8') + fragment + b'</fragment>')
+    return wrapper[0]
+
+
+def write_unit(fp, tu_id, element, index=None):
+    """Replace a single trans-unit in a file without parsing the whole document.
+
+    Arguments:
+        fp -- Path to SDLXLIFF file
+        tu_id -- Ordinal of the MT trans-unit (int) or its "id" attribute (str)
+        element -- Trans-unit element returned by load_unit()
+        index -- Optional index returned by load_index()
+
+    Returns:
+        index -- Updated index
+    """
+    index = load_index(fp) if index is None else index
+    pos = find_unit(index, tu_id)
+    _, start, end = index["units"][pos]
+
+    # Serialize a copy of the wrapper to avoid redundant namespace declarations on the trans-unit.
+    # Working on a copy keeps the caller's element unchanged.
+    parent = element.getparent()
+    if parent is not None and parent.tag == "fragment" and len(parent) == 1:
+        wrapper = copy.deepcopy(parent)
+        wrapper[0].tail = None
+        fragment = ET.tostring(wrapper, encoding='utf-8')
+        fragment = fragment[fragment.index(b'>') + 1:-len(b'</fragment>')]
+    else:
+        unit = copy.deepcopy(element)
+        unit.tail = None
+        fragment = ET.tostring(unit, encoding='utf-8')
+
+    tmp = fp + ".tmp"
+    with open(fp, 'rb') as src, open(tmp, 'wb') as dst:
+        dst.write(src.read(start))
+        dst.write(fragment)
+        src.seek(end)
+        while True:
+            chunk = src.read(1 << 20)
+            if not chunk:
+                break
+            dst.write(chunk)
+    shutil.copymode(fp, tmp)
+    os.replace(tmp, fp)
+
+    # Shift offsets of all following units instead of rescanning the file
+    delta = len(fragment) - (end - start)
+    index["units"][pos][2] += delta
+    for unit in index["units"][pos + 1:]:
+        unit[1] += delta
+        unit[2] += delta
+
+    stat = os.stat(fp)
+    index["size"], index["mtime"] = stat.st_size, stat.st_mtime_ns
+    save_index(fp, index)
+
+    return index
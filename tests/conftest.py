@@ -0,0 +1,73 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source.entries import SearchMTEntry, SearchSourceEntry, ToggleCaseEntry
+
+HEADER = ('<?xml version="1.0" encoding="utf-8"?>\n'
+          '<xliff xmlns:sdl="http://sdl.com/FileTypes/SdlXliff/1.0" '
+          'xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2" sdl:version="1.0">\n'
+          '<file original="a.docx" source-language="en-US" target-language="es-ES" '
+          'datatype="x-sdlfilterframework2">\n<body>\n')
+FOOTER = '</body>\n</file>\n</xliff>\n'
+
+
+def trans_unit(tu_id, source, target, origin="mt"):
+    """Return a trans-unit string with a single segment."""
+    return ('<trans-unit id="{0}"><source>{1}</source>'
+            '<seg-source><mrk mtype="seg" mid="{0}">{1}</mrk></seg-source>'
+            '<target><mrk mtype="seg" mid="{0}">{2}</mrk></target>'
+            '<sdl:seg-defs><sdl:seg id="{0}" origin="{3}"/></sdl:seg-defs></trans-unit>\n'
+            ).format(tu_id, source, target, origin)
+
+
+def make_xliff(units):
+    return HEADER + ''.join(units) + FOOTER
+
+
+@pytest.fixture
+def sdlxliff(tmp_path):
+    """SDLXLIFF file with ten MT trans-units and one TM trans-unit."""
+
+    units = [trans_unit("u{}".format(i), "Heterozygosity {}".format(i),
+                        "heterocigosidad <g id=\"{0}\">{0}</g> temprano".format(i)) for i in range(10)]
+    units.insert(3, trans_unit("tm", "Nothing", "nada", origin="tm"))
+    fp = tmp_path / "sample.sdlxliff"
+    fp.write_text(make_xliff(units), encoding="utf-8")
+
+    return str(fp)
+
+
+def make_table():
+    """PED table with chained and overlapping edits. Every (source, target, MT) row occurs three times."""
+    rows = [
+        ("CONTENTS: a", "CONTENIDO - a", "CONTENIDO: a", 0.25),
+        ("CONTENTS: a", "CONTENIDO: a x", "CONTENIDO: a", 0.5),
+        ("pain scores high", "puntaje de dolor alto", "puntuaciones de dolor altas", 0.4),
+        ("pain scores high", "puntuaciones de dolor", "puntuaciones de dolor altas", 0.3),
+        ("early onset", "inicio precoz", "inicio temprano", 0.35),
+        ("early onset", "inicio temprano", "inicio temprano", 0.0),
+        ("late onset", "inicio tardío", "inicio temprano", 0.45),
+        ("heterozygosity", "heterocigosis", "heterocigosidad", 0.2),
+        ("index", "índice", "índice", 0.0),
+        ("no match", "sin cambios", "sin cambio", 0.1),
+    ]
+    return pd.DataFrame(rows * 3, columns=["source", "target", "mt", "score"])
+
+
+def make_entries():
+    return [
+        SearchMTEntry({"desc": "chain1", "search": "CONTENIDO:", "replace": "CONTENIDO -"}),
+        SearchMTEntry({"desc": "overlap1", "search": "dolor", "replace": "DOLOR"}),
+        SearchSourceEntry({"desc": "source", "search": "tempran[ao]s?", "replace": "precoz",
+                           "source_filter": "\\bearly\\b"}),
+        SearchMTEntry({"desc": "chain2", "search": "CONTENIDO -", "replace": "CONTENIDO —"}),
+        SearchMTEntry({"desc": "overlap2", "search": "altas", "replace": "alto"}),
+        SearchMTEntry({"desc": "reset", "search": "índice", "replace": "índice"}),
+        SearchMTEntry({"desc": "het", "search": "heterocigosidad", "replace": "heterocigosis"}),
+        ToggleCaseEntry({"desc": "upper", "search": 1, "replace": "upper"}),
+    ]
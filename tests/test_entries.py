@@ -0,0 +1,76 @@
+import pytest
+from lxml import etree as ET
+
+from conftest import make_xliff
+from source.entries import SearchMTEntry, ToggleCaseEntry
+from source.xliff import create_tree
+
+MULTI_SEGMENT = ('<trans-unit id="m"><source>Hello more things</source>'
+                 '<seg-source><mrk mtype="seg" mid="1">Hello</mrk> <mrk mtype="seg" mid="2">more things</mrk></seg-source>'
+                 '<target><mrk mtype="seg" mid="1">Hola</mrk><mrk mtype="seg" mid="2">mas cosas</mrk></target>'
+                 '<sdl:seg-defs><sdl:seg id="1" origin="mt"/><sdl:seg id="2" origin="tm"/></sdl:seg-defs>'
+                 '</trans-unit>\n')
+
+INLINE_TAG = ('<trans-unit id="i"><source>early onset</source>'
+              '<seg-source><mrk mtype="seg" mid="3">early onset</mrk></seg-source>'
+              '<target><mrk mtype="seg" mid="3">inicio <g id="1">tem</g>prano</mrk></target>'
+              '<sdl:seg-defs><sdl:seg id="3" origin="mt"/></sdl:seg-defs></trans-unit>\n')
+
+
+def load_units(tmp_path, *units):
+    fp = tmp_path / "test.sdlxliff"
+    fp.write_text(make_xliff(units), encoding="utf-8")
+    return create_tree(str(fp))[1]
+
+
+def find_target(tu):
+    return tu.find("xliff:target", {"xliff": "urn:oasis:names:tc:xliff:document:1.2"})
+
+
+def target_texts(tu):
+    return [''.join(mrk.itertext()) for mrk in find_target(tu)]
+
+
+@pytest.mark.parametrize("search, expected", [
+    ("\\bmas\\b", ["Hola", "más cosas"]),
+    ("^mas", ["Hola", "más cosas"]),
+    ("^Hola$", ["Hola!", "mas cosas"]),
+])
+def test_search_matches_within_segments(tmp_path, search, expected):
+    replace = "Hola!" if "Hola" in search else "más"
+    tus = load_units(tmp_path, MULTI_SEGMENT)
+    assert len(tus) == 1
+
+    changed = SearchMTEntry({"desc": "test", "search": search, "replace": replace}).search_and_replace(tus)
+
+    assert changed == tus
+    assert target_texts(tus[0]) == expected
+
+
+def test_search_does_not_cross_segments(tmp_path):
+    tus = load_units(tmp_path, MULTI_SEGMENT)
+
+    assert SearchMTEntry({"desc": "test", "search": "Holamas", "replace": "x"}).search_and_replace(tus) == []
+
+
+def test_search_joins_inline_tags(tmp_path):
+    tus = load_units(tmp_path, INLINE_TAG)
+
+    changed = SearchMTEntry({"desc": "test", "search": "^inicio temprano$", "replace": "inicio precoz"}
+                            ).search_and_replace(tus)
+
+    # The match spans the inline tag and is left unchanged, but it is found in one segment
+    assert changed == []
+    changed = SearchMTEntry({"desc": "test", "search": "^inicio ", "replace": "Inicio "}).search_and_replace(tus)
+    assert changed == tus
+    assert ET.tostring(find_target(tus[0]), encoding="unicode").count('<g id="1">tem</g>prano') == 1
+    assert target_texts(tus[0]) == ["Inicio temprano"]
+
+
+def test_toggle_case_first_segment(tmp_path):
+    tus = load_units(tmp_path, MULTI_SEGMENT.replace(">Hola<", ">hola<"))
+
+    changed = ToggleCaseEntry({"desc": "test", "search": 1, "replace": "upper"}).search_and_replace(tus)
+
+    assert changed == tus
+    assert target_texts(tus[0]) == ["Hola", "mas cosas"]
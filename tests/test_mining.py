@@ -0,0 +1,109 @@
+import random
+import re
+from collections import Counter
+
+import pandas as pd
+import pytest
+
+from source.calculation import levenshtein, pe_density
+from source.mining import SpaceSaving, edit_candidates, mine_entries, mine_rulebook
+from source.subs import PreprocSub
+
+
+def test_space_saving_bounds():
+    rng = random.Random(0)
+    # Skewed stream with a long tail of rare keys
+    stream = [min(int(rng.paretovariate(1.0)), 200) for _ in range(5000)]
+    exact = Counter(stream)
+    sketch = SpaceSaving(capacity=10)
+    for key in stream:
+        sketch.update(key)
+
+    assert len(sketch.counts) == 10
+    assert sum(sketch.counts.values()) == len(stream)
+    minimum = min(sketch.counts.values())
+    # No key is underestimated, and the error of each key is bounded by the smallest count
+    for key, count, error in sketch.top():
+        assert count - error <= exact[key] <= count
+        assert error <= minimum <= len(stream) / 10
+    # Keys that are more frequent than the smallest count are tracked
+    assert {key for key, count in exact.items() if count > minimum} <= set(sketch.counts)
+    assert sketch.top(3)[0][0] == exact.most_common(1)[0][0]
+
+
+def test_space_saving_eviction():
+    sketch = SpaceSaving(capacity=2)
+    for key, weight in (("a", 3), ("b", 1), ("c", 2)):
+        sketch.update(key, weight)
+
+    # "c" replaces "b" and inherits its count as error
+    assert sketch.top() == [("a", 3, 0), ("c", 3, 1)]
+
+
+@pytest.mark.parametrize("mt, target, level, context, expected", [
+    # Replacement, deletion and insertion with one token of context
+    ("el paciente tiene dolor", "el enfermo tiene dolor", "token", 1,
+     [("\\bel paciente tiene\\b", "el enfermo tiene")]),
+    ("el paciente tiene dolor", "el paciente dolor", "token", 1, [("\\bpaciente tiene dolor\\b", "paciente dolor")]),
+    ("el paciente dolor", "el paciente tiene dolor", "token", 1, [("\\bpaciente dolor\\b", "paciente tiene dolor")]),
+    # Without context, the whitespace next to an edit is part of it
+    ("el paciente tiene dolor", "el enfermo tiene dolor", "token", 0, [(" paciente ", " enfermo ")]),
+    ("el paciente tiene dolor", "el paciente dolor", "token", 0, [(" tiene ", " ")]),
+    ("CONTENIDO: a", "CONTENIDO - a", "token", 0, [(": ", " - ")]),
+    # Insertions without context cannot be anchored
+    ("el paciente dolor", "el paciente tiene dolor", "token", 0, []),
+    # Word boundaries are only added where the edit starts or ends at a word boundary
+    ("temprano", "tamprano", "char", 1, [("\\btem", "tam")]),
+    ("temprano", "tamprano", "char", 0, [("e", "a")]),
+    ("dolores", "dolor", "char", 1, [("res\\b", "r")]),
+    ("dolores", "dolor", "char", 0, [("es\\b", "")]),
+    ("dolor", "dolores", "char", 1, [("r\\b", "res")]),
+    ("x a+b y", "x a-b y", "char", 0, [("\\+", "-")]),
+])
+def test_edit_candidates(mt, target, level, context, expected):
+    candidates = edit_candidates(mt, target, level=level, context=context)
+
+    assert candidates == expected
+    for search, replace in candidates:
+        assert re.sub(search, replace, mt) == target
+
+
+def test_edit_candidates_escape_backslashes():
+    mt, target = "ruta C:\\temp ok", "ruta C:\\tmp ok"
+    candidates = edit_candidates(mt, target)
+
+    assert candidates == [("\\\\temp ok\\b", "\\\\tmp ok")]
+    assert re.sub(*candidates[0], mt) == target
+
+
+def make_edits():
+    rows = [("el paciente tiene dolor {}".format(i), "el enfermo tiene dolor {}".format(i)) for i in range(30)]
+    rows += [("CONTENIDO: a {}".format(i), "CONTENIDO - a {}".format(i)) for i in range(20)]
+    rows += [("sin cambios {}".format(i), "sin cambios {}".format(i)) for i in range(10)]
+    df = pd.DataFrame(rows, columns=["mt", "target"])
+    df["source"] = "source"
+    df["score"] = [levenshtein(t, m) / max(len(t), len(m)) for m, t in zip(df.mt, df.target)]
+    return df
+
+
+def test_mine_entries():
+    df = make_edits()
+    entries = mine_entries([df.iloc[:25], df.iloc[25:]], top_k=2)
+
+    assert [(entry.search, entry.replace) for entry in entries] == [
+        ("\\bel paciente tiene\\b", "el enfermo tiene"), ("\\bCONTENIDO: a\\b", "CONTENIDO - a")]
+    assert mine_entries(df, min_count=31) == []
+
+
+def test_mine_rulebook_round_trip(tmp_path):
+    fp = str(tmp_path / "mined.json")
+    mine_rulebook(make_edits(), fp=fp, desc="mined")
+
+    subs = PreprocSub(fp=fp)
+    before, _ = pe_density(make_edits())
+    df = subs.apply_to_table(make_edits())
+    after, _ = pe_density(df)
+
+    assert subs.desc == "mined"
+    assert after == 0
+    assert subs.ped_effect == pytest.approx(before)
@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+from lxml import etree as ET
+
+from conftest import make_entries, make_table
+from source.entries import SearchMTEntry
+from source.subs import PreprocSub
+from source.table import ARROW_STRING, to_string_dtype
+from source.xliff import create_tree
+
+
+@pytest.mark.parametrize("dtype", [object, ARROW_STRING])
+def test_waves_match_serial(dtype):
+    serial = PreprocSub(entries=make_entries())
+    expected = serial.apply_to_table(to_string_dtype(make_table(), dtype))
+
+    waves = PreprocSub(entries=make_entries())
+    analysis = waves.analyze_entries(to_string_dtype(make_table(), dtype))
+    result = waves.apply_to_table(to_string_dtype(make_table(), dtype), parallel=True, max_workers=2)
+
+    assert len(analysis.waves) > 1
+    assert set(analysis.conflicts) >= {(0, 3), (1, 4)}
+    assert result.mt.tolist() == expected.mt.tolist()
+    assert result.lev.tolist() == expected.lev.tolist()
+    assert result.virtual.tolist() == expected.virtual.tolist()
+    assert waves.ped_effect == pytest.approx(serial.ped_effect, abs=1e-12)
+    # Entries are sorted by their effect, so compare them by description.
+    effects = {entry.desc: entry.ped_effect for entry in serial.entries}
+    assert {entry.desc: entry.ped_effect for entry in waves.entries} == pytest.approx(effects, abs=1e-12)
+
+
+def test_analyze_units(sdlxliff):
+    entries = [SearchMTEntry({"desc": "het", "search": "heterocigosidad", "replace": "heterocigosis"}),
+               SearchMTEntry({"desc": "het2", "search": "heterocigosis", "replace": "HET"}),
+               SearchMTEntry({"desc": "early", "search": "temprano", "replace": "precoz"}),
+               SearchMTEntry({"desc": "early2", "search": "temprano|precoz", "replace": "tardío"})]
+    tree, tus = create_tree(sdlxliff)
+    before = ET.tostring(tree)
+
+    analysis = PreprocSub(entries=entries).analyze_entries(tus)
+
+    # The units are not changed
+    assert ET.tostring(tree) == before
+    assert [list(units) for units in analysis.assigned] == [list(range(10))] * 4
+    assert list(analysis.conflicts[(0, 1)]["chain"]) == list(range(10))
+    assert list(analysis.conflicts[(2, 3)]["overlap"]) == list(range(10))
+    assert "chain:\t[0] het -> [1] het2\t(10 items)" in analysis.report()
+    assert "overlap:\t[2] early -> [3] early2\t(10 items)" in analysis.report()
+
+    # The same units are changed when the entries are applied
+    changed = PreprocSub(entries=entries).apply_to_units(tus)
+    assert sorted(changed) == sorted(tu.get("id") for tu in tus)
+    assert all([entry.desc for entry in changed[tu_id]] == ["het", "het2", "early", "early2"] for tu_id in changed)
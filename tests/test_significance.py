@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from source.significance import bootstrap_ped, compare_groups, resample_ped, unique_pairs
+
+
+def make_components(n, seed=0):
+    rng = np.random.default_rng(seed)
+    max_char = rng.integers(5, 200, n).astype(float)
+    lev = np.floor(max_char * rng.beta(1, 4, n))
+    return lev, max_char
+
+
+def test_unique_pairs():
+    lev, max_char = make_components(10000)
+    pairs, counts = unique_pairs(lev, max_char)
+    expected_pairs, expected_counts = np.unique(np.column_stack([lev, max_char]), axis=0, return_counts=True)
+
+    assert (pairs == expected_pairs).all()
+    assert (counts == expected_counts).all()
+
+
+def test_poisson_bootstrap_matches_exact_bootstrap():
+    lev, max_char = make_components(30000)
+    approx = resample_ped(lev, max_char, 2000, np.random.default_rng(1), max_exact=200)
+    exact = resample_ped(lev, max_char, 2000, np.random.default_rng(2), max_exact=10 ** 6)
+
+    assert abs(approx.std() / exact.std() - 1) < 0.1
+    assert np.allclose(np.quantile(approx, [0.025, 0.975]), np.quantile(exact, [0.025, 0.975]), atol=exact.std() / 2)
+
+
+def test_bootstrap_empty_input():
+    result = bootstrap_ped(pd.DataFrame({"lev": [], "max_char": []}), n_resamples=100)
+
+    assert result.loc["All", "segments"] == 0
+    assert result.loc["All", ["ped", "lower", "upper"]].isna().all()
+
+
+def make_groups():
+    frames = list()
+    for seed, (group, scale) in enumerate((("A", 1.0), ("B", 1.0), ("C", 1.5))):
+        lev, max_char = make_components(3000, seed)
+        frames.append(pd.DataFrame({"lev": np.minimum(lev * scale, max_char), "max_char": max_char,
+                                    "Relation": group}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def test_compare_groups():
+    df = make_groups()
+    result = compare_groups(df, "Relation", n_resamples=2000, seed=0)
+
+    assert list(result.index) == [("A", "B"), ("A", "C"), ("B", "C")]
+    point = df.groupby("Relation").lev.sum() / df.groupby("Relation").max_char.sum()
+    for (a, b), row in result.iterrows():
+        assert row["diff"] == pytest.approx(point[a] - point[b])
+        assert row["lower"] <= row["diff"] <= row["upper"]
+    # Groups from the same distribution do not differ, the third group does
+    assert result.loc[("A", "B"), "lower"] < 0 < result.loc[("A", "B"), "upper"]
+    assert result.loc[("A", "B"), "p_value"] > 0.05
+    assert result.loc[("A", "C"), "upper"] < 0 and result.loc[("B", "C"), "upper"] < 0
+    assert result.loc[("A", "C"), "p_value"] < 0.01
+
+    # Results are reproducible with a seed
+    pd.testing.assert_frame_equal(result, compare_groups(df, "Relation", n_resamples=2000, seed=0))
+
+
+def test_widget_plots_interval(monkeypatch):
+    pytest.importorskip("ipywidgets")
+    from source import controls
+
+    calls = list()
+    monkeypatch.setattr(controls, "plot", lambda data, **kwargs: calls.append(kwargs))
+    df = make_groups()
+    df["target"], df["mt"], df["score"] = "a", "b", df.lev / df.max_char
+    widget = controls.MyFilterWidget.__new__(controls.MyFilterWidget)
+
+    widget.plot(df, cat_column="Relation")
+    widget.plot(df, ci=0.95, n_resamples=500, cat_column="Relation")
+
+    assert calls[0]["ped_ci"] is None
+    lower, upper = calls[1]["ped_ci"]
+    assert lower < calls[1]["ped"] < upper
+    assert calls[1]["cat_column"] == "Relation"
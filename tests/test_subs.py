@@ -0,0 +1,145 @@
+import os
+import pickle
+
+import pytest
+
+import pandas as pd
+
+from conftest import make_entries, make_table
+from source.calculation import pe_density
+from source.entries import SearchMTEntry
+from source.table import read_chunks
+from source.subs import CACHE_HEADER, PreprocSub, compiled_rulebook_path
+
+
+def make_rulebook(fp, search="heterocigosidad"):
+    entries = [SearchMTEntry({"search": search, "replace": "heterocigosis", "desc": "het"})]
+    PreprocSub(entries=entries).convert_to_json(str(fp))
+    return str(fp)
+
+
+def test_compiled_rulebook_cache(tmp_path):
+    fp = make_rulebook(tmp_path / "rules.json")
+
+    first = PreprocSub(fp=fp)
+    with open(compiled_rulebook_path(fp), 'rb') as f:
+        assert f.readline().startswith(CACHE_HEADER)
+        cached = pickle.load(f)
+    # Compiled patterns are not part of the cache
+    assert "_patterns" not in cached["entries"][0].__dict__
+
+    second = PreprocSub(fp=fp)
+    assert second.entries[0].__getstate__() == first.entries[0].__getstate__()
+    # Cached entries are compiled on first use
+    assert "_patterns" not in second.entries[0].__dict__
+    assert second.entries[0].get_pattern().sub("x", "la heterocigosidad") == "la x"
+
+
+class Marker(object):
+    """Creates a directory when it is unpickled."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return os.mkdir, (self.path,)
+
+
+@pytest.mark.parametrize("header", [b"", CACHE_HEADER + b"0" * 64 + b"\n"])
+def test_stale_cache_is_not_unpickled(tmp_path, header):
+    fp = make_rulebook(tmp_path / "rules.json")
+    marker = str(tmp_path / "unpickled")
+    with open(compiled_rulebook_path(fp), 'wb') as f:
+        f.write(header)
+        pickle.dump({"data": Marker(marker)}, f)
+
+    subs = PreprocSub(fp=fp)
+
+    assert not os.path.exists(marker)
+    assert subs.entries[0].search == "heterocigosidad"
+    # The cache has been replaced
+    with open(compiled_rulebook_path(fp), 'rb') as f:
+        assert f.readline().startswith(CACHE_HEADER)
+
+
+def test_invalid_pattern_fails_on_load(tmp_path):
+    fp = make_rulebook(tmp_path / "rules.json", search="(unclosed")
+
+    with pytest.raises(ValueError):
+        PreprocSub(fp=fp)
+
+
+def test_apply_to_archive(tmp_path, sdlxliff):
+    from zipfile import ZipFile
+
+    fp = str(tmp_path / "package.zip")
+    with ZipFile(fp, 'w') as z:
+        z.write(sdlxliff, "a.sdlxliff")
+        z.writestr("readme.txt", "unchanged")
+
+    subs = PreprocSub(fp=make_rulebook(tmp_path / "rules.json"))
+    cache = subs.apply_to_archive(fp)
+
+    assert len(cache[str(tmp_path / "package.zip" / "a.sdlxliff")]) == 10
+    with ZipFile(str(tmp_path / "package_out.zip")) as z:
+        assert z.read("readme.txt") == b"unchanged"
+        assert b"heterocigosis" in z.read("a.sdlxliff")
+
+
+def test_apply_to_archive_removes_partial_output(tmp_path, sdlxliff):
+    from zipfile import ZipFile
+
+    fp = str(tmp_path / "package.zip")
+    with ZipFile(fp, 'w') as z:
+        z.write(sdlxliff, "a.sdlxliff")
+        z.writestr("b.sdlxliff", "<xliff><broken")
+
+    subs = PreprocSub(fp=make_rulebook(tmp_path / "rules.json"))
+    with pytest.raises(Exception):
+        subs.apply_to_archive(fp)
+
+    assert not (tmp_path / "package_out.zip").exists()
+
+
+def test_cli_apply_dry_run_writes_nothing(tmp_path, sdlxliff, capsys):
+    from source.cli import main
+
+    (tmp_path / "rules").mkdir()
+    rulebook = make_rulebook(tmp_path / "rules" / "rules.json")
+    with open(sdlxliff, 'rb') as f:
+        before = f.read()
+
+    main(["apply", rulebook, str(tmp_path), "--dry-run"])
+
+    assert "10 trans-units changed" in capsys.readouterr().out
+    assert sorted(path.name for path in tmp_path.rglob("*")) == ["rules", "rules.json", "sample.sdlxliff"]
+    with open(sdlxliff, 'rb') as f:
+        assert f.read() == before
+
+    main(["apply", rulebook, str(tmp_path)])
+
+    assert (tmp_path / "Backup_SDLXLIFF.zip").exists()
+    assert os.path.exists(compiled_rulebook_path(rulebook))
+
+
+@pytest.mark.parametrize("chunksize", [1, 4, 7])
+@pytest.mark.parametrize("ext", [".csv", ".parquet"])
+def test_apply_to_chunks_matches_table(tmp_path, chunksize, ext):
+    # Sorted, so that chunks split the copies of a row
+    df = make_table().sort_values(["source", "mt"], kind="stable").reset_index(drop=True)
+    serial = PreprocSub(entries=make_entries())
+    expected = serial.apply_to_table(df.copy())
+
+    chunked = PreprocSub(entries=make_entries())
+    out_fp = str(tmp_path / ("out" + ext))
+    ped = chunked.apply_to_chunks((df.iloc[i:i + chunksize].copy() for i in range(0, len(df), chunksize)), out_fp)
+
+    assert ped == pytest.approx(pe_density(expected)[0], abs=1e-12)
+    assert chunked.ped_effect == pytest.approx(serial.ped_effect, abs=1e-12)
+    # Entries are sorted by their effect, so compare them by description.
+    effects = {entry.desc: entry.ped_effect for entry in serial.entries}
+    assert {entry.desc: entry.ped_effect for entry in chunked.entries} == pytest.approx(effects, abs=1e-12)
+
+    result = pd.concat(read_chunks(out_fp), ignore_index=True)
+    columns = ["source", "target", "mt", "max_char", "lev", "virtual"]
+    pd.testing.assert_frame_equal(result[columns], expected[columns].reset_index(drop=True), check_dtype=False)
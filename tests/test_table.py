@@ -0,0 +1,86 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+import pytest
+
+from source.table import export_report, read_chunks, save_chunks
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_report(groups, rows_per_group):
+    return pd.DataFrame({"Project": ["P{}".format(i % groups) for i in range(groups * rows_per_group)],
+                         "mt": ["mt {}".format(i) for i in range(groups * rows_per_group)]})
+
+
+@pytest.mark.parametrize("name", ["report.xls", "report.txt", "report"])
+def test_export_report_rejects_unknown_extension(tmp_path, name):
+    fp = str(tmp_path / name)
+
+    with pytest.raises(ValueError):
+        export_report(make_report(2, 2), fp)
+    with pytest.raises(ValueError):
+        save_chunks([make_report(2, 2)], fp)
+    with pytest.raises(ValueError):
+        next(read_chunks(fp))
+    assert not os.path.exists(fp)
+
+
+def test_export_report_extension_case(tmp_path):
+    fp = str(tmp_path / "report.XLSX")
+
+    assert export_report(make_report(2, 3), fp, split_by="Project") == {"P0": 3, "P1": 3}
+    assert sorted(pd.read_excel(fp, sheet_name=None, engine="openpyxl")) == ["P0", "P1"]
+
+    fp = str(tmp_path / "report.CSV")
+    assert export_report(make_report(2, 3), fp) == {"report.CSV": 6}
+    assert len(pd.concat(read_chunks(fp))) == 6
+
+
+def test_export_report_limits_open_sheets(tmp_path):
+    # Rows of all groups are interleaved across chunks, so every chunk writes to every sheet.
+    fp = str(tmp_path / "report.xlsx")
+    script = ("import resource, sys\n"
+              "sys.path.insert(0, {root!r})\n"
+              "resource.setrlimit(resource.RLIMIT_NOFILE, (256, resource.getrlimit(resource.RLIMIT_NOFILE)[1]))\n"
+              "from tests.test_table import make_report\n"
+              "from source.table import export_report\n"
+              "rows = export_report(make_report(400, 3), {fp!r}, split_by='Project', chunksize=400)\n"
+              "assert len(rows) == 400 and set(rows.values()) == {{3}}, rows\n").format(root=ROOT, fp=fp)
+
+    subprocess.run([sys.executable, "-c", script], check=True, cwd=ROOT)
+
+    sheets = pd.read_excel(fp, sheet_name=None, engine="openpyxl")
+    assert len(sheets) == 400
+    assert sheets["P7"].mt.tolist() == ["mt 7", "mt 407", "mt 807"]
+
+
+def test_export_report_without_sheet_hooks(tmp_path, monkeypatch, caplog):
+    # Other xlsxwriter versions may not have the private hooks
+    monkeypatch.setattr("source.table.can_close_sheets", lambda: False)
+    fp = str(tmp_path / "report.xlsx")
+
+    rows = export_report(make_report(5, 2), fp, split_by="Project", max_open_sheets=2)
+
+    assert rows == {"P{}".format(i): 2 for i in range(5)}
+    assert "cannot close sheet files" in caplog.text
+    assert len(pd.read_excel(fp, sheet_name=None, engine="openpyxl")) == 5
+
+
+def test_export_report_without_sheet_hooks_error(tmp_path):
+    fp = str(tmp_path / "report.xlsx")
+    script = ("import resource, sys\n"
+              "sys.path.insert(0, {root!r})\n"
+              "resource.setrlimit(resource.RLIMIT_NOFILE, (256, resource.getrlimit(resource.RLIMIT_NOFILE)[1]))\n"
+              "import source.table\n"
+              "source.table.can_close_sheets = lambda: False\n"
+              "from tests.test_table import make_report\n"
+              "from source.table import export_report\n"
+              "export_report(make_report(400, 3), {fp!r}, split_by='Project', chunksize=400)\n").format(root=ROOT, fp=fp)
+
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+
+    assert result.returncode != 0
+    assert "OSError: Could not keep" in result.stderr
@@ -0,0 +1,82 @@
+import os
+import stat
+
+from lxml import etree as ET
+
+from conftest import make_xliff, trans_unit
+from source.xliff import NAMESPACES, build_index, create_tree, index_path, load_index, load_unit, write_unit
+
+
+def target_text(tu):
+    return ''.join(tu.find("xliff:target", NAMESPACES).itertext())
+
+
+def test_index_matches_create_tree(sdlxliff):
+    _, tus = create_tree(sdlxliff)
+    index = load_index(sdlxliff)
+
+    assert [unit[0] for unit in index["units"]] == [tu.get("id") for tu in tus]
+    for pos, tu in enumerate(tus):
+        assert index["ids"][tu.get("id")] == pos
+        assert ET.tostring(load_unit(sdlxliff, pos, index)) == ET.tostring(tu, with_tail=False)
+
+
+def test_write_unit_shifts_offsets(sdlxliff):
+    index = load_index(sdlxliff)
+
+    # Grow one unit and shrink another, then check all offsets against a fresh scan.
+    for tu_id, text in (("u4", "heterocigosis " * 20), ("u7", "")):
+        element = load_unit(sdlxliff, tu_id, index)
+        element.find("xliff:target/xliff:mrk", NAMESPACES).text = text
+        tail = element.tail
+        index = write_unit(sdlxliff, tu_id, element, index)
+        # The caller's element is not changed
+        assert element.tail == tail
+
+    fresh = build_index(sdlxliff)
+    assert index["units"] == fresh["units"]
+    assert index["ids"] == fresh["ids"]
+
+    _, tus = create_tree(sdlxliff)
+    assert target_text(tus[4]).startswith("heterocigosis heterocigosis")
+    assert target_text(tus[7]) == "7 temprano"
+    for pos, tu in enumerate(tus):
+        assert ET.tostring(load_unit(sdlxliff, pos)) == ET.tostring(tu, with_tail=False)
+
+
+def test_write_unit_keeps_permissions(sdlxliff):
+    os.chmod(sdlxliff, 0o640)
+    element = load_unit(sdlxliff, "u1")
+    write_unit(sdlxliff, "u1", element)
+
+    assert stat.S_IMODE(os.stat(sdlxliff).st_mode) == 0o640
+
+
+def test_index_without_sidecar(sdlxliff):
+    # The sidecar cannot be written if its path is taken, as in a read-only location.
+    os.mkdir(index_path(sdlxliff))
+
+    element = load_unit(sdlxliff, "u2")
+    element.find("xliff:target/xliff:mrk", NAMESPACES).text = "cambiado"
+    index = write_unit(sdlxliff, "u2", element)
+
+    assert index["units"] == build_index(sdlxliff)["units"]
+    assert target_text(load_unit(sdlxliff, "u2", index)) == "cambiado2 temprano"
+
+
+def test_index_chunk_sizes(tmp_path):
+    # Units of different lengths so that tags are split at every position between chunks
+    units = [trans_unit("u{}".format(i), "Source {}".format(i), "destino " * (i % 17),
+                        origin="tm" if i % 5 == 0 else "mt") for i in range(3000)]
+    fp = tmp_path / "large.sdlxliff"
+    fp.write_text(make_xliff(units), encoding="utf-8")
+
+    index = build_index(str(fp))
+    _, tus = create_tree(str(fp))
+    assert [unit[0] for unit in index["units"]] == [tu.get("id") for tu in tus]
+
+    for chunk_size in (7, 64, 1 << 12):
+        small = build_index(str(fp), chunk_size=chunk_size)
+        assert small["units"] == index["units"]
+        assert small["ids"] == index["ids"]
+        assert small["ns"] == index["ns"]